@@ -0,0 +1,819 @@
+"""
+Model of the mph Meter, without any GUI dependencies.
+
+MphMeter implements the serial protocol of the mph Meter Firmware and is
+used by the configurator GUI (mph_meter_configurator.py), the command line
+interface (mph_meter_cli.py) and all other tools.
+
+Required modules:
+-pyserial (serial)
+"""
+
+import os.path
+
+#Used for decoding pulse stream records and binary frames
+import binascii
+import collections
+import struct
+import time
+
+#Using pyserial for serial port communication
+import serial
+
+#Counters and latency histograms of the communication (see MphMeter.stats)
+from mph_meter_stats import MeterStats, OK, ERROR, TIMEOUT
+
+#Default values to programm into mph Meter when Restore Defaults button is clicked
+DEFAULTS = {
+    'muempp_µm': 43000,
+    'debounce_ms': 0,
+    'vwarn_v': 7.5,
+    }
+
+#Firmware image programmed by MphMeter.flash_fw
+FW_HEX = os.path.join('.', 'mph_meter.ino.standard.hex')
+#Maximum time avrdude may take for flashing the Firmware (s)
+AVRDUDE_TIMEOUT_S = 10
+#Reply timeout for the first command after flashing: mph Meter shows its greeting (about 2s) before it answers
+GREETING_TIMEOUT_S = 3
+
+#Binary record sent by mph Meter for every pulse in streaming mode: header, 8 bit sequence number, timestamp (µs)
+STREAM_HEADER = 0xA5
+STREAM_RECORD = struct.Struct('<BBL')
+
+#Pulse yielded by MphMeter.stream
+#timestamp_us: time of the pulse in µs (monotonic, micros() wrap-arounds of mph Meter are compensated)
+#interval_us: time since the previous pulse in µs (0 for the first pulse)
+#lost: number of pulses dropped by the mph Meter right before this one
+Pulse = collections.namedtuple('Pulse', ['timestamp_us', 'interval_us', 'lost'])
+#First Firmware version supporting the s command (pulse streaming)
+STREAM_VERSION = (0, 3)
+#Speed in m/h per (µm per µs), same formula as calc_mph() of the mph Meter Firmware
+SPEED_FACTOR = 3600.0
+
+#Keyword arguments of MphMeter.set_many for each value of a settings profile (see DEFAULTS)
+PROFILE_KEYS = {
+    'debounce_ms': 'debounce',
+    'muempp_µm': 'muempp',
+    'vwarn_v': 'vcrit',
+    }
+
+#Name, lower and upper boundary and unit of every value, keys are the keyword arguments of MphMeter.set_many
+BOUNDARIES = {
+    'debounce': ('debounce time (ms)', 0, 999999, 'ms'),
+    'muempp': ('µm per Pulse', 0, 999999999, 'µm/pulse'),
+    'vcrit': ('V(crit)', 0, 15, 'V'),
+    }
+
+#Position of every value in the list returned by MphMeter.read, keys are the keyword arguments of MphMeter.set_many
+VALUE_INDEX = {
+    'muempp': 0,
+    'debounce': 1,
+    'vcrit': 3,
+    }
+
+#Size of the hardware serial rx buffer of the mph Meter. Bytes sent while it is full are lost
+RX_WINDOW = 63
+
+#Baudrate offered to mph Meter by MphMeter.negotiate_baudrate (requires Firmware v0.5)
+FAST_BAUDRATE = 115200
+#Time after which mph Meter restores its default baudrate, if the new one was not confirmed
+BAUDRATE_CONFIRM_S = 1.0
+
+#Binary frames (requires Firmware v0.6): start byte, length of command + payload, command, payload, CRC-16/CCITT (init 0xFFFF, little endian)
+#over length, command and payload. The payload of replies starts with a status byte
+FRAME_START = 0x7E
+FRAME_CRC = struct.Struct('<H')
+FRAME_STATUS = {0: 'OK', 1: 'ERR'}
+FRAME_CRC_ERROR = 2
+#Payload of the reply to r: muempp, debounce, vcrit (mV), vbat (mV), version major, version minor
+FRAME_READ = struct.Struct('<LLHHBB')
+#Payload of m, d and t
+FRAME_VALUE = struct.Struct('<L')
+#Payload of a: bit mask of values to change (1: muempp, 2: debounce, 4: vcrit), muempp, debounce, vcrit (mV)
+FRAME_MANY = struct.Struct('<BLLL')
+BINARY_VERSION = (0, 6)
+
+#First Firmware version supporting the a command (set several values at once)
+SET_MANY_VERSION = (0, 4)
+
+
+#Exceptions
+class ReplyError(Exception):
+    """Raised when an invalid reply from mph Meter received"""
+    def __init__(self, text=None, value=None):
+        super().__init__()
+        self.text = text
+        self.value = value
+
+class BoundaryError(Exception):
+    """Raised when trying to set a value of the mph Meter that is out of boundaries"""
+    def __init__(self, text, value=None):
+        super().__init__()
+        self.text = text
+        self.value = value
+    def __str__(self):
+        return self.text + ' ({})'.format(repr(self.value))
+
+class NotConnectedError(Exception):
+    """Raised when an operation is performed on mph Meter, before it was connected"""
+    pass
+
+class LostConnectionError(Exception):
+    """Raised when connection to mph Meter is broken"""
+    pass
+
+
+#Model
+class MphMeter():
+    """Abstraction model / implementation of mph Meter"""
+    
+    def __init__(self, baudrate=9600, timeout=0.9, cache_ttl=10.0):
+        """cache_ttl: time in seconds for which read(vbat=False) answers from the settings last read (0: always read)"""
+        
+        self._serial = serial.Serial(baudrate=baudrate,timeout=timeout)
+        #Baudrate mph Meter uses after reset
+        self._baudrate = baudrate
+        #Firmware version of the connected mph Meter as tuple, None until the first read
+        self._version = None
+        #Use binary frames instead of text commands
+        self._binary = False
+        #Settings last read from mph Meter (see read), kept up to date by successful set commands
+        self.cache_ttl = cache_ttl
+        self._snapshot = None
+        self._snapshot_time = 0.0
+        #Statistics of all commands sent, kept across connections (see mph_meter_stats.py)
+        self.stats = MeterStats()
+
+    def _runcmd(self, cmd):
+        """Send command over serial port and return reply"""
+        
+        if not self._serial.is_open:
+            raise NotConnectedError
+        
+        frame = (cmd + '\n').encode('ascii')
+        try:
+            start = time.perf_counter()
+            self._serial.write(frame)
+            self._serial.flush()
+            raw = self._serial.read_until(b'\n')
+        except serial.SerialException:
+            self._serial.close()
+            raise LostConnectionError
+        
+        reply = raw.decode('ascii', errors='ignore').strip()
+        outcome = TIMEOUT if not raw.endswith(b'\n') else ERROR if reply == 'ERR' else OK
+        self.stats.record(cmd[:1], time.perf_counter() - start, len(frame), len(raw), outcome)
+        return reply
+
+    @staticmethod
+    def _frame(cmd, payload=b''):
+        """Build binary frame for command cmd"""
+        
+        body = bytes([len(payload) + 1]) + cmd.encode('ascii') + payload
+        return bytes([FRAME_START]) + body + FRAME_CRC.pack(binascii.crc_hqx(body, 0xFFFF))
+
+    def _runframe(self, cmd, payload=b''):
+        """Send binary frame and return status ('OK', 'ERR' or '' if no reply was received) and data of the reply"""
+        
+        if not self._serial.is_open:
+            raise NotConnectedError
+        
+        frame = self._frame(cmd, payload)
+        try:
+            started = time.perf_counter()
+            self._serial.write(frame)
+            self._serial.flush()
+            
+            #Skip anything in front of the reply frame
+            received = 0
+            start = self._serial.read(1)
+            while start != b'' and start[0] != FRAME_START:
+                received += 1
+                start = self._serial.read(1)
+            length = self._serial.read(1)
+            rest = self._serial.read(length[0] + 2) if length else b''
+        except serial.SerialException:
+            self._serial.close()
+            raise LostConnectionError
+        
+        received += len(start) + len(length) + len(rest)
+        latency = time.perf_counter() - started
+        if not length or len(rest) != length[0] + 2:
+            self.stats.record(cmd, latency, len(frame), received, TIMEOUT)
+            return '', b''
+        
+        status = FRAME_STATUS.get(rest[1], 'ERR') if length[0] >= 2 else 'ERR'
+        self.stats.record(cmd, latency, len(frame), received, OK if status == 'OK' else ERROR)
+        
+        body = length + rest[:-2]
+        error = None
+        if FRAME_CRC.unpack(rest[-2:])[0] != binascii.crc_hqx(body, 0xFFFF):
+            error = 'Corrupted reply received (CRC mismatch)'
+        elif length[0] < 2 or rest[0:1] != cmd.encode('ascii'):
+            error = 'Incorrect reply received: {}'.format(repr(body))
+        elif rest[1] == FRAME_CRC_ERROR:
+            error = 'mph Meter received corrupted command (CRC mismatch)'
+        if error is not None:
+            self.stats.reply_error(cmd)
+            raise ReplyError(error, body)
+        
+        return status, rest[2:-2]
+
+    def pipeline(self, cmds, window=RX_WINDOW):
+        """Send several commands back-to-back and return their replies in the same order.
+        New commands are written while earlier replies are still outstanding, as long as the bytes in flight fit into window
+        (the rx buffer of mph Meter). mph Meter answers every command exactly once and in order.
+        If a reply times out, it and all following replies are returned as empty strings, as they can no longer be matched."""
+        
+        if not self._serial.is_open:
+            raise NotConnectedError
+        
+        frames = [(cmd + '\n').encode('ascii') for cmd in cmds]
+        for frame in frames:
+            if len(frame) > window:
+                raise ValueError('Command does not fit into window: {}'.format(repr(frame)))
+        
+        replies = []
+        #Length and send time of the commands whose replies are outstanding
+        in_flight = collections.deque()
+        sent = 0
+        
+        try:
+            while len(replies) < len(frames):
+                #Fill window
+                batch = []
+                while sent < len(frames) and sum(length for length, _ in in_flight) + sum(map(len, batch)) + len(frames[sent]) <= window:
+                    batch.append(frames[sent])
+                    sent += 1
+                if batch:
+                    now = time.perf_counter()
+                    in_flight.extend((len(frame), now) for frame in batch)
+                    self._serial.write(b''.join(batch))
+                    self._serial.flush()
+                
+                reply = self._serial.read_until(b'\n')
+                length, started = in_flight.popleft()
+                cmd = cmds[len(replies)][:1]
+                if not reply.endswith(b'\n'):
+                    #Timeout: drop late replies that would otherwise be matched to later commands
+                    self._serial.reset_input_buffer()
+                    self.stats.record(cmd, time.perf_counter() - started, length, len(reply), TIMEOUT)
+                    replies.extend([''] * (len(frames) - len(replies)))
+                    break
+                replies.append(reply.decode('ascii', errors='ignore').strip())
+                self.stats.record(cmd, time.perf_counter() - started, length, len(reply), ERROR if replies[-1] == 'ERR' else OK)
+        except serial.SerialException:
+            self._serial.close()
+            raise LostConnectionError
+        
+        #Keep remembered settings in line with what the commands programmed
+        for cmd, reply in zip(cmds, replies):
+            if cmd[:1] in ('r', 'i'):
+                continue
+            values = self._cmdvalues(cmd)
+            if values is not None and reply == 'OK':
+                self._remember(values)
+            else:
+                self.invalidate()
+        
+        return replies
+
+    def read_many(self, count, window=RX_WINDOW):
+        """Read settings count times in a pipeline (see pipeline). Returns a list of results like read"""
+        
+        try:
+            values = [self._parsevalues(reply) for reply in self.pipeline(['r'] * count, window)]
+        except ReplyError:
+            self.stats.reply_error('r')
+            raise
+        if values:
+            self._version = self._versiontuple(values[-1][2])
+            self._store(values[-1])
+        return values
+
+    @staticmethod
+    def _checkboundaries(value, name, b_low, b_high, unit=''):
+        """Raise BoundaryError if value is not within b_low and b_high"""
+        
+        if not b_low <= value <= b_high:
+            raise BoundaryError('{name} must be between {b_low}{unit} and {b_high}{unit}!'.format(name=name, b_low=b_low, b_high=b_high, unit=unit), value)
+
+    @staticmethod
+    def _checkreply(reply, name):
+        """Evaluate reply of mph Meter to a set command. Raise ReplyError if it was not OK"""
+        
+        if reply == 'ERR':
+            raise ReplyError('Error setting {name} value'.format(name=name))
+        elif reply == '':
+            raise ReplyError('No reply received')
+        elif reply!= 'OK':
+            raise ReplyError('Incorrect reply received: {}'.format(repr(reply)))
+
+    @staticmethod
+    def _versiontuple(version):
+        """Convert version string of mph Meter into a comparable tuple"""
+        
+        try:
+            return tuple(int(part) for part in version.split('.'))
+        except ValueError:
+            return (0,)
+
+    @staticmethod
+    def _manyvalues(muempp=None, debounce=None, vcrit=None):
+        """Keyword arguments of set_many as dict, without the values that are None"""
+        
+        return {name: value for name, value in (('muempp', muempp), ('debounce', debounce), ('vcrit', vcrit)) if value is not None}
+
+    @staticmethod
+    def _profilevalues(profile):
+        """Convert settings profile (dict with the same keys as DEFAULTS) into keyword arguments of set_many. Unknown keys are ignored"""
+        
+        return {PROFILE_KEYS[key]: value for key, value in profile.items() if key in PROFILE_KEYS}
+
+    @staticmethod
+    def _profilekeys(names):
+        """Convert names of set_many keyword arguments back into profile keys"""
+        
+        keys = {name: key for key, name in PROFILE_KEYS.items()}
+        return [keys[name] for name in names]
+
+    @staticmethod
+    def _singlevalues(values, version):
+        """Values (see _manyvalues) to be set with one command each and in this order, as Firmware version (tuple) does not support the a command.
+        Empty list if the a command is supported"""
+        
+        if version >= SET_MANY_VERSION:
+            return []
+        return [(name, values[name]) for name in ('debounce', 'muempp', 'vcrit') if name in values]
+
+    @staticmethod
+    def _cmdvalues(cmd):
+        """Values (keyword arguments of set_many) programmed by text command cmd (m, d, t or a) or None for other commands"""
+        
+        names = {'m': ['muempp'], 'd': ['debounce'], 't': ['vcrit'], 'a': ['muempp', 'debounce', 'vcrit']}.get(cmd[:1])
+        fields = cmd[1:].split(';')
+        if names is None or len(fields) != len(names):
+            return None
+        
+        values = {}
+        try:
+            for name, field in zip(names, fields):
+                if field != '':
+                    values[name] = int(field)/1000 if name == 'vcrit' else int(field)
+        except ValueError:
+            return None
+        return values
+
+    @classmethod
+    def _manycmd(cls, values):
+        """Check boundaries of all values (keyword arguments of set_many) and build the a command"""
+        
+        for name, value in values.items():
+            if name not in BOUNDARIES:
+                raise TypeError('Unknown value: {}'.format(name))
+            cls._checkboundaries(value, *BOUNDARIES[name])
+        
+        fields = [
+            '' if 'muempp' not in values else '{:d}'.format(values['muempp']),
+            '' if 'debounce' not in values else '{:d}'.format(values['debounce']),
+            '' if 'vcrit' not in values else '{:d}'.format(int(values['vcrit']*1000)),
+            ]
+        return 'a' + ';'.join(fields)
+
+    @classmethod
+    def _diff(cls, values, current):
+        """Split values (keyword arguments of set_many) into the ones differing from current settings (see read) and the names of the others.
+        Boundaries of all values are checked first"""
+        
+        for name, value in values.items():
+            if name not in BOUNDARIES:
+                raise TypeError('Unknown value: {}'.format(name))
+            cls._checkboundaries(value, *BOUNDARIES[name])
+        
+        changed = {}
+        skipped = []
+        for name, value in values.items():
+            if name == 'vcrit':
+                #mph Meter stores mV
+                equal = int(value*1000) == round(current[VALUE_INDEX[name]]*1000)
+            else:
+                equal = value == current[VALUE_INDEX[name]]
+            if equal:
+                skipped.append(name)
+            else:
+                changed[name] = value
+        return changed, skipped
+
+    @staticmethod
+    def _parsevalues(reply):
+        """Convert reply of the read command into list [muempp_µm, debounce_ms, version, vwarn_v, vbat_v]"""
+        
+        parts = reply.split(';')
+        if len(parts) != 5:
+            raise ReplyError('Incorrect reply received (Number of items missmatched).', parts)
+
+        try:
+            parts[0] = int(parts[0])
+            parts[1] = int(parts[1])
+            parts[2] = str(parts[2])
+            parts[3] = float(parts[3])/1000
+            parts[4] = float(parts[4])/1000
+        except ValueError:
+            raise ReplyError('Could not convert data.', parts)
+
+        return parts
+
+    def _setvalue(self, cmd, value, name, b_low, b_high, unit=''):
+        """Programm a value into mph Meter. Eveluate boundaries, evaluate reply from mph Meter and show success/fail dialogs accordingly"""
+        
+        if not self._serial.is_open:
+            raise NotConnectedError
+        
+        self._checkboundaries(value, name, b_low, b_high, unit)
+        
+        if self._binary:
+            reply, data = self._runframe(cmd[0], FRAME_VALUE.pack(int(cmd[1:])))
+        else:
+            reply = self._runcmd(cmd)
+        
+        try:
+            self._checkreply(reply, name)
+        except ReplyError:
+            #Without a reply it is unknown whether the value was programmed
+            self.invalidate()
+            self.stats.reply_error(cmd[0])
+            raise
+
+    def _store(self, values):
+        """Remember settings read from mph Meter"""
+        
+        self._snapshot = list(values)
+        self._snapshot_time = time.monotonic()
+
+    def _remember(self, values):
+        """Update remembered settings with values (keyword arguments of set_many) that were programmed successfully"""
+        
+        if self._snapshot is None:
+            return
+        for name, value in values.items():
+            #Same resolution as mph Meter stores the value
+            self._snapshot[VALUE_INDEX[name]] = int(value*1000)/1000 if name == 'vcrit' else value
+
+    def invalidate(self):
+        """Forget the remembered settings, so the next read goes to mph Meter"""
+        
+        self._snapshot = None
+
+    def connect(self, port, test=True, fast_baudrate=None, binary=False):
+        """Establish connection to physical mph Meter over serial port. Automatically disconnects from any previous connection.
+        If test is True, the mph Meter is identified with the i command before the connection is considered as established.
+        If fast_baudrate is given, switching to it is tried afterwards (see negotiate_baudrate).
+        If binary is True, binary frames are used instead of text commands if the Firmware supports them (v0.6)."""
+
+        self.disconnect()
+        self._version = None
+        self._binary = False
+        self.invalidate()
+
+        connected = False
+        reason = ''
+        
+        try:
+            self._serial.baudrate = self._baudrate
+            self._serial.port = port
+            self._serial.open()
+        except serial.SerialException:
+            connected = False
+            reason = 'Could not open serial port'
+        else:
+            if test:
+                if self._runcmd('i') == 'mph Meter':
+                    connected = True
+                else:
+                    connected = False
+                    reason = 'mph Meter did not respond at given serial port'
+            else:
+                connected = True
+
+        if connected is not True and self._serial.is_open:
+            self._serial.close()
+
+        if connected is True and fast_baudrate is not None:
+            self.negotiate_baudrate(fast_baudrate)
+
+        if connected is True and binary:
+            self.read()
+            self._binary = self._version >= BINARY_VERSION
+
+        return connected, reason
+
+    def disconnect(self):
+        if self._serial.is_open:
+            #Switch mph Meter back, so the next connection finds it at its default baudrate
+            if self._serial.baudrate != self._baudrate:
+                try:
+                    self._serial.write('b{:d}\n'.format(self._baudrate).encode('ascii'))
+                    self._serial.flush()
+                    self._serial.read_until(b'\n')
+                except serial.SerialException:
+                    pass
+            self._serial.close()
+
+    def negotiate_baudrate(self, baudrate=FAST_BAUDRATE):
+        """Switch mph Meter and serial port to a higher baudrate and return the baudrate in use afterwards.
+        If mph Meter does not support it (e.g. Firmware older than v0.5), the previous baudrate is kept.
+        If it does not answer at the new baudrate, mph Meter falls back to its default baudrate on its own after BAUDRATE_CONFIRM_S
+        (not to the previous one), so the serial port is switched back to the default baudrate as well."""
+        
+        previous = self._serial.baudrate
+        if baudrate == previous:
+            return previous
+        
+        if self._runcmd('b{:d}'.format(baudrate)) != 'OK':
+            return previous
+        
+        try:
+            self._serial.baudrate = baudrate
+            #Give mph Meter the time to reconfigure its UART after sending the reply
+            time.sleep(0.01)
+            self._serial.reset_input_buffer()
+            confirmed = self._runcmd('i') == 'mph Meter'
+        except (ValueError, serial.SerialException):
+            confirmed = False
+        
+        if not confirmed and self._serial.is_open:
+            self._serial.baudrate = self._baudrate
+            time.sleep(BAUDRATE_CONFIRM_S)
+            self._serial.reset_input_buffer()
+            return self._baudrate
+        
+        return baudrate
+
+    @staticmethod
+    def avrdude_args(port):
+        """Command line for running avrdude to programm the Firmware into the mph Meter at given port"""
+        
+        return [
+            os.path.abspath(os.path.join('.', 'avrdude', 'avrdude.exe')),
+             '-C', os.path.abspath(os.path.join('.', 'avrdude', 'avrdude.conf')),
+             '-v',
+             '-p', 'atmega328p',
+             '-c', 'arduino',
+             '-P', '{}'.format(port),
+             '-b', '115200',
+             '-D',
+             '-U', 'flash:w:{}:i'.format(os.path.abspath(FW_HEX)),
+             ]
+
+    @classmethod
+    def flash_fw(cls, port, use_avrdude=False, progress=None, cancel=None):
+        """Classmethod for programming Firmware into a potentially unprogrammed mph Meter.
+        By default the built-in STK500v1 programmer (mph_meter_stk500.py) is used, which resets the Arduino over DTR.
+        On boards without automatic reset and with use_avrdude, the user has to press the Reset button on the Arduino and release it right after calling this function.
+        progress(phase, page, page_count) is called after every page written by the built-in programmer (see mph_meter_stk500.flash).
+        Flashing is aborted (returning False) as soon as the threading.Event cancel is set."""
+        
+        #Imported here, as mph_meter_stk500 depends on this module
+        import mph_meter_stk500 as stk500
+        
+        #Batch flashing (mph_meter_flash.py) must not consider this device up to date based on what was flashed before
+        device = stk500.device_id(port)
+        stk500.record_device(device, None)
+        
+        if not use_avrdude:
+            def report(phase, page, page_count):
+                if cancel is not None and cancel.is_set():
+                    raise stk500.ReplyError('Flashing cancelled')
+                if progress is not None:
+                    progress(phase, page, page_count)
+            
+            try:
+                stk500.flash(port, progress=report)
+            except (stk500.ReplyError, stk500.LostConnectionError, serial.SerialException, OSError, ValueError):
+                return False
+            stk500.record_device(device, stk500.hex_digest())
+            return True
+        
+        #Only imported when avrdude is used, as it is slow to import
+        import subprocess
+        
+        #The image avrdude writes is not known to the flash cache of the built-in programmer
+        stk500.store_cached_image(device, None)
+        
+        avrdude = subprocess.Popen(
+            cls.avrdude_args(port),
+            encoding='ASCII',
+            errors='ignore'
+            )
+        
+        deadline = time.monotonic() + AVRDUDE_TIMEOUT_S
+        while avrdude.poll() is None:
+            if time.monotonic() > deadline or (cancel is not None and cancel.is_set()):
+                avrdude.kill()
+                avrdude.wait()
+                return False
+            time.sleep(0.1)
+
+        if avrdude.returncode != 0:
+            return False
+        else:
+            stk500.record_device(device, stk500.hex_digest())
+            return True
+
+    def set_defaults(self):
+        """Programm mph Meter defaults"""
+        
+        self.set_profile(DEFAULTS)
+
+    def set_profile(self, profile):
+        """Programm all values of a settings profile (dict with the same keys as DEFAULTS, missing keys are left untouched)"""
+        
+        self.set_many(**self._profilevalues(profile))
+
+    def apply_profile(self, profile):
+        """Programm only the values of a settings profile that differ from the current settings (see apply_many).
+        Returns list of the profile keys that were skipped"""
+        
+        return self._profilekeys(self.apply_many(**self._profilevalues(profile)))
+
+    def apply_many(self, muempp=None, debounce=None, vcrit=None):
+        """Like set_many, but values already programmed into mph Meter are not sent again, which also saves EEPROM write cycles.
+        The current settings are taken from read(vbat=False). Returns list of the names of the values that were skipped"""
+        
+        if not self._serial.is_open:
+            raise NotConnectedError
+        
+        values = self._manyvalues(muempp, debounce, vcrit)
+        if not values:
+            return []
+        
+        changed, skipped = self._diff(values, self.read(vbat=False))
+        self.set_many(**changed)
+        return skipped
+
+    def set_many(self, muempp=None, debounce=None, vcrit=None):
+        """Set several values with a single command, so mph Meter writes its EEPROM only once. Values that are None are left unchanged.
+        All boundaries are checked before anything is sent. Falls back to one command per value for Firmware older than v0.4"""
+        
+        if not self._serial.is_open:
+            raise NotConnectedError
+        
+        values = self._manyvalues(muempp, debounce, vcrit)
+        cmd = self._manycmd(values)
+        if not values:
+            return
+        
+        if self._version is None:
+            self.read()
+        
+        single = self._singlevalues(values, self._version)
+        if single:
+            for name, value in single:
+                getattr(self, 'set_' + name)(value)
+            return
+        
+        if self._binary:
+            mask = sum(bit for bit, name in ((1, 'muempp'), (2, 'debounce'), (4, 'vcrit')) if name in values)
+            payload = FRAME_MANY.pack(mask, values.get('muempp', 0), values.get('debounce', 0), int(values.get('vcrit', 0)*1000))
+            reply, data = self._runframe('a', payload)
+        else:
+            reply = self._runcmd(cmd)
+        try:
+            self._checkreply(reply, ', '.join(BOUNDARIES[name][0] for name in values))
+        except ReplyError:
+            self.invalidate()
+            self.stats.reply_error('a')
+            raise
+        self._remember(values)
+
+    def read(self, vbat=True):
+        """Read settings from mph Meter. Returns list [muempp_µm, debounce_ms, version, vwarn_v, vbat_v].
+        The battery voltage is the only value mph Meter changes on its own, so reading it always goes to mph Meter.
+        With vbat=False, the settings last read are returned instead if they are younger than cache_ttl seconds
+        (vbat_v is then the voltage measured back then)."""
+        
+        if not vbat and self._snapshot is not None and time.monotonic() - self._snapshot_time < self.cache_ttl:
+            return list(self._snapshot)
+        
+        if self._binary:
+            reply, data = self._runframe('r')
+            if reply != 'OK' or len(data) != FRAME_READ.size:
+                self.stats.reply_error('r')
+                raise ReplyError('Incorrect reply received.', data)
+            muempp, debounce, vcrit, vbat, major, minor = FRAME_READ.unpack(data)
+            values = [muempp, debounce, '{}.{}'.format(major, minor), vcrit/1000, vbat/1000]
+        else:
+            reply = self._runcmd('r')
+            try:
+                values = self._parsevalues(reply)
+            except ReplyError:
+                self.stats.reply_error('r')
+                raise
+        self._version = self._versiontuple(values[2])
+        self._store(values)
+        return values
+
+    @staticmethod
+    def _parsestream(buf):
+        """Split buffer into complete stream records and remaining bytes. Bytes not belonging to a record are skipped"""
+        
+        records = []
+        pos = 0
+        while len(buf) - pos >= STREAM_RECORD.size:
+            if buf[pos] != STREAM_HEADER:
+                pos = buf.find(STREAM_HEADER, pos + 1)
+                if pos == -1:
+                    return records, b''
+                continue
+            records.append(STREAM_RECORD.unpack_from(buf, pos))
+            pos += STREAM_RECORD.size
+        return records, buf[pos:]
+
+    def stream(self, duration=None, stop=None):
+        """Generator yielding a Pulse for every pulse measured by mph Meter. Streaming is stopped when the generator is closed, after duration seconds
+        or once the threading.Event stop is set. No other commands may be sent while streaming."""
+        
+        if not self._serial.is_open:
+            raise NotConnectedError
+        
+        if self._version is None:
+            self.read()
+        if self._version < STREAM_VERSION:
+            raise ReplyError('mph Meter Firmware v{} does not support streaming (v{}.{} or newer required)'.format('.'.join(map(str, self._version)), *STREAM_VERSION), self._version)
+        
+        try:
+            self._checkreply(self._runcmd('s1'), 'streaming mode')
+        except ReplyError:
+            self.stats.reply_error('s')
+            raise
+        
+        end = None if duration is None else time.monotonic() + duration
+        buf = b''
+        last_raw = None
+        last_seq = None
+        offset = 0
+        last_timestamp = None
+        
+        try:
+            while (end is None or time.monotonic() < end) and (stop is None or not stop.is_set()):
+                try:
+                    data = self._serial.read(max(STREAM_RECORD.size, self._serial.in_waiting))
+                except serial.SerialException:
+                    self._serial.close()
+                    raise LostConnectionError
+                self.stats.add_received('s', len(data))
+                buf += data
+                
+                records, buf = self._parsestream(buf)
+                for header, seq, raw in records:
+                    if last_raw is not None and raw < last_raw:
+                        offset += 1 << 32
+                    timestamp = raw + offset
+                    interval = 0 if last_timestamp is None else timestamp - last_timestamp
+                    lost = 0 if last_seq is None else (seq - last_seq - 1) & 0xFF
+                    last_raw, last_seq, last_timestamp = raw, seq, timestamp
+                    yield Pulse(timestamp, interval, lost)
+        finally:
+            if self._serial.is_open:
+                #Records still in flight are discarded together with the reply
+                try:
+                    self._serial.write(b's0\n')
+                    self._serial.flush()
+                    self._serial.read_until(b'OK\n')
+                    self._serial.reset_input_buffer()
+                except serial.SerialException:
+                    self._serial.close()
+
+    def set_debounce(self, value):
+        """Set additional software debounce time in miliseconds"""
+        
+        self._setvalue('d{:d}'.format(value), value, *BOUNDARIES['debounce'])
+        self._remember({'debounce': value})
+
+    def set_muempp(self, value):
+        """Set µm/pulse"""
+        
+        self._setvalue('m{:d}'.format(value), value, *BOUNDARIES['muempp'])
+        self._remember({'muempp': value})
+        
+    def set_vcrit(self, value):
+        """Set V(crit). If the supply voltage of the mph Meter is below this threshold during startup, a warning message will be displayed on the LCD"""
+        
+        self._setvalue('t{:d}'.format(int(value*1000)), value, *BOUNDARIES['vcrit'])
+        self._remember({'vcrit': value})
+
+    #Boolean var indicating wether an instance is connected or not
+    is_connected = property(lambda x: x._serial.is_open)
+
+    #Baudrate currently used for communication
+    baudrate = property(lambda x: x._serial.baudrate)
+
+    #Reply timeout in seconds
+    timeout = property(lambda x: x._serial.timeout, lambda x, value: setattr(x._serial, 'timeout', value))
+
+    #Boolean var indicating wether binary frames are used instead of text commands
+    is_binary = property(lambda x: x._binary)
+
+    #Serial port of the (last) connection or None
+    port = property(lambda x: x._serial.port)
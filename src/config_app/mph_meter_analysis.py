@@ -0,0 +1,85 @@
+"""
+Vectorized speed computation over captured pulse streams (see MphMeter.stream).
+
+Same formula as calc_mph() of the mph Meter Firmware, but for whole arrays
+of pulse timestamps at once: instantaneous, windowed and exponentially
+smoothed speed in m/h. No Python loops run per pulse.
+
+Required modules:
+-numpy
+-pyserial (serial), imported by mph_meter.py
+"""
+
+import numpy as np
+
+from mph_meter import SPEED_FACTOR
+
+#Maximum span of a segment in time constants for exponential smoothing. Keeps exp() within float64 range
+_SEGMENT_TAUS = 300.0
+
+
+def timestamps(pulses):
+    """Convert Pulse tuples (see MphMeter.stream) into an int64 array of timestamps in µs"""
+
+    return np.fromiter((pulse.timestamp_us for pulse in pulses), dtype=np.int64)
+
+
+class SpeedAnalysis():
+    """Speed computation for pulse timestamps (µs) of one mph Meter"""
+
+    def __init__(self, muempp):
+        self.muempp = muempp
+
+    @classmethod
+    def from_meter(cls, meter):
+        """Use µm/pulse value programmed into a connected MphMeter"""
+
+        return cls(meter.read()[0])
+
+    def instantaneous(self, timestamps_us):
+        """Speed (m/h) of every interval between two pulses. The result has one item less than timestamps_us"""
+
+        intervals = np.diff(np.asarray(timestamps_us, dtype=np.float64))
+        with np.errstate(divide='ignore'):
+            return np.where(intervals > 0, self.muempp * SPEED_FACTOR / intervals, np.nan)
+
+    def windowed(self, timestamps_us, window_s):
+        """Average speed (m/h) over the window_s seconds up to every pulse. NaN if there is no earlier pulse within the window"""
+
+        t = np.asarray(timestamps_us, dtype=np.float64)
+        first = np.searchsorted(t, t - window_s * 1e6, side='left')
+        pulses = np.arange(len(t)) - first
+        span = t - t[first]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(span > 0, pulses * self.muempp * SPEED_FACTOR / span, np.nan)
+
+    def smoothed(self, timestamps_us, tau_s):
+        """Exponentially smoothed speed (m/h) with time constant tau_s seconds, one item per interval like instantaneous.
+        Every interval is weighted according to its duration: y[n] = y[n-1] + (1 - exp(-dt[n] / tau)) * (x[n] - y[n-1])"""
+
+        t = np.asarray(timestamps_us, dtype=np.float64)[1:]
+        x = self.instantaneous(timestamps_us)
+        if len(x) == 0:
+            return x
+
+        tau = tau_s * 1e6
+        alpha = -np.expm1(-np.diff(t, prepend=t[0]) / tau)
+        alpha[0] = 1.0
+        weighted = np.nan_to_num(alpha * x)
+
+        #y[n] = y[c] * exp(-(t[n] - t[c]) / tau) + sum(alpha[k] * x[k] * exp(-(t[n] - t[k]) / tau)) for k after c
+        #is evaluated with cumsum per segment. Only the few segments are looped, not the pulses
+        segment = ((t - t[0]) // (_SEGMENT_TAUS * tau)).astype(np.int64)
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(segment)) + 1, [len(t)]))
+
+        y = np.empty_like(x)
+        carry = 0.0
+        carry_t = t[0]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            growth = np.exp((t[start:end] - t[start]) / tau)
+            initial = carry * np.exp(-(t[start] - carry_t) / tau)
+            y[start:end] = (initial + np.cumsum(weighted[start:end] * growth)) / growth
+            carry = y[end - 1]
+            carry_t = t[end - 1]
+
+        return y
@@ -0,0 +1,196 @@
+"""
+Asyncio implementation of the mph Meter model.
+
+AsyncMphMeter speaks the same r/m/d/t/i command set as MphMeter, but awaits
+replies through an event loop reader instead of blocking the calling thread.
+This allows a single process to talk to many mph Meters at once.
+
+Required modules:
+-pyserial (serial)
+-pyserial-asyncio (serial_asyncio)
+"""
+
+import asyncio
+
+#Using pyserial for serial port communication
+import serial
+import serial_asyncio
+
+from mph_meter import (
+    DEFAULTS,
+    BOUNDARIES,
+    MphMeter,
+    NotConnectedError,
+    LostConnectionError,
+    )
+
+
+#Model
+class AsyncMphMeter():
+    """Asyncio abstraction model / implementation of mph Meter"""
+
+    def __init__(self, baudrate=9600, timeout=0.9):
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        #Firmware version of the connected mph Meter as tuple, None until the first read
+        self._version = None
+        #Only one command may be on the wire at once, otherwise replies get mixed up
+        self._lock = asyncio.Lock()
+
+    async def _runcmd(self, cmd):
+        """Send command over serial port and await reply"""
+
+        if not self.is_connected:
+            raise NotConnectedError
+
+        async with self._lock:
+            try:
+                self._writer.write((cmd + '\n').encode('ascii'))
+                await self._writer.drain()
+                reply = await asyncio.wait_for(self._reader.readuntil(b'\n'), self.timeout)
+            except asyncio.TimeoutError:
+                #Same behaviour as MphMeter: a timeout results in an empty reply
+                reply = b''
+            except (asyncio.IncompleteReadError, serial.SerialException, OSError):
+                self._close()
+                raise LostConnectionError
+
+        return reply.decode('ascii', errors='ignore').strip()
+
+    async def _setvalue(self, cmd, value, name, b_low, b_high, unit=''):
+        """Programm a value into mph Meter. Eveluate boundaries and evaluate reply from mph Meter"""
+
+        if not self.is_connected:
+            raise NotConnectedError
+
+        MphMeter._checkboundaries(value, name, b_low, b_high, unit)
+
+        reply = await self._runcmd(cmd)
+
+        MphMeter._checkreply(reply, name)
+
+    def _close(self):
+        """Close transport without waiting for it"""
+
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def connect(self, port, test=True):
+        """Establish connection to physical mph Meter over serial port. Automatically disconnects from any previous connection.
+        If test is True, the mph Meter is identified with the i command before the connection is considered as established."""
+
+        await self.disconnect()
+        self._version = None
+
+        connected = False
+        reason = ''
+
+        try:
+            self._reader, self._writer = await serial_asyncio.open_serial_connection(url=port, baudrate=self.baudrate)
+        except serial.SerialException:
+            connected = False
+            reason = 'Could not open serial port'
+        else:
+            if test:
+                if await self._runcmd('i') == 'mph Meter':
+                    connected = True
+                else:
+                    connected = False
+                    reason = 'mph Meter did not respond at given serial port'
+            else:
+                connected = True
+
+        if connected is not True and self.is_connected:
+            await self.disconnect()
+
+        return connected, reason
+
+    async def disconnect(self):
+        if self._writer is not None:
+            writer = self._writer
+            self._close()
+            await writer.wait_closed()
+
+    async def set_defaults(self):
+        """Programm mph Meter defaults"""
+
+        await self.set_profile(DEFAULTS)
+
+    async def set_profile(self, profile):
+        """Programm all values of a settings profile (dict with the same keys as DEFAULTS, missing keys are left untouched)"""
+
+        await self.set_many(**MphMeter._profilevalues(profile))
+
+    async def apply_profile(self, profile):
+        """Programm only the values of a settings profile that differ from the current settings (see MphMeter.apply_profile).
+        Returns list of the profile keys that were skipped"""
+
+        return MphMeter._profilekeys(await self.apply_many(**MphMeter._profilevalues(profile)))
+
+    async def apply_many(self, muempp=None, debounce=None, vcrit=None):
+        """Like set_many, but values already programmed into mph Meter are not sent again. Returns list of the names of the values that were skipped"""
+
+        if not self.is_connected:
+            raise NotConnectedError
+
+        values = MphMeter._manyvalues(muempp, debounce, vcrit)
+        if not values:
+            return []
+
+        changed, skipped = MphMeter._diff(values, await self.read())
+        await self.set_many(**changed)
+        return skipped
+
+    async def set_many(self, muempp=None, debounce=None, vcrit=None):
+        """Set several values with a single command, so mph Meter writes its EEPROM only once. Values that are None are left unchanged.
+        All boundaries are checked before anything is sent. Falls back to one command per value for Firmware older than v0.4"""
+
+        if not self.is_connected:
+            raise NotConnectedError
+
+        values = MphMeter._manyvalues(muempp, debounce, vcrit)
+        cmd = MphMeter._manycmd(values)
+        if not values:
+            return
+
+        if self._version is None:
+            await self.read()
+
+        single = MphMeter._singlevalues(values, self._version)
+        if single:
+            for name, value in single:
+                await getattr(self, 'set_' + name)(value)
+            return
+
+        reply = await self._runcmd(cmd)
+        MphMeter._checkreply(reply, ', '.join(BOUNDARIES[name][0] for name in values))
+
+    async def read(self):
+        """Read settings from mph Meter"""
+
+        reply = await self._runcmd('r')
+        values = MphMeter._parsevalues(reply)
+        self._version = MphMeter._versiontuple(values[2])
+        return values
+
+    async def set_debounce(self, value):
+        """Set additional software debounce time in miliseconds"""
+
+        await self._setvalue('d{:d}'.format(value), value, *BOUNDARIES['debounce'])
+
+    async def set_muempp(self, value):
+        """Set µm/pulse"""
+
+        await self._setvalue('m{:d}'.format(value), value, *BOUNDARIES['muempp'])
+
+    async def set_vcrit(self, value):
+        """Set V(crit). If the supply voltage of the mph Meter is below this threshold during startup, a warning message will be displayed on the LCD"""
+
+        await self._setvalue('t{:d}'.format(int(value*1000)), value, *BOUNDARIES['vcrit'])
+
+    #Boolean var indicating wether an instance is connected or not
+    is_connected = property(lambda x: x._writer is not None and not x._writer.is_closing())
@@ -0,0 +1,135 @@
+"""
+Round-trip latency benchmark of the configuration protocol.
+
+Every MphMeter operation (connect, read, set_*, set_defaults) is run
+repeatedly against a simulated mph Meter (see mph_meter_simulator.py) for
+every combination of baud rate, timeout, device latency and loop period.
+Latency percentiles and throughput are emitted as JSON.
+
+Required modules:
+-pyserial (serial)
+"""
+
+#Used for command line interface (CLI)
+import argparse
+
+import itertools
+import json
+import math
+import sys
+import time
+
+from mph_meter import (
+    DEFAULTS,
+    MphMeter,
+    ReplyError,
+    BoundaryError,
+    NotConnectedError,
+    LostConnectionError,
+    )
+from mph_meter_simulator import SimulatedMeter
+
+#Operations to benchmark. Each is called with a connected MphMeter and the port
+OPERATIONS = {
+    'connect': lambda meter, port: meter.connect(port)[0],
+    'read': lambda meter, port: meter.read(),
+    'set_muempp': lambda meter, port: meter.set_muempp(DEFAULTS['muempp_µm']),
+    'set_debounce': lambda meter, port: meter.set_debounce(DEFAULTS['debounce_ms']),
+    'set_vcrit': lambda meter, port: meter.set_vcrit(DEFAULTS['vwarn_v']),
+    'set_defaults': lambda meter, port: meter.set_defaults(),
+    }
+
+
+def percentile(values, p):
+    """p-th percentile (nearest rank) of sorted values"""
+
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def measure(operation, meter, port, repeat):
+    """Run operation repeat times and return latency statistics in ms"""
+
+    latencies = []
+    errors = 0
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        try:
+            if OPERATIONS[operation](meter, port) is False:
+                errors += 1
+        except (ReplyError, BoundaryError, NotConnectedError, LostConnectionError):
+            errors += 1
+        latencies.append((time.perf_counter() - begin) * 1000)
+
+        #Keep going with the next iteration, even if the connection was lost
+        if not meter.is_connected:
+            meter.connect(port, test=False)
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'count': repeat,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / len(latencies),
+        'throughput_ops': repeat / total,
+        }
+
+
+def run(operations=tuple(OPERATIONS), baudrates=(9600,), timeouts=(0.9,), latencies=(0.0,), loop_periods=(0.05,), repeat=20):
+    """Benchmark all operations for every combination of the given parameters. Returns list of result dicts"""
+
+    results = []
+    for baudrate, timeout, latency, loop_period in itertools.product(baudrates, timeouts, latencies, loop_periods):
+        with SimulatedMeter(latency=latency, baudrate=baudrate, loop_period=loop_period) as device:
+            meter = MphMeter(baudrate=baudrate, timeout=timeout)
+            meter.connect(device.port, test=False)
+            try:
+                for operation in operations:
+                    result = {
+                        'operation': operation,
+                        'baudrate': baudrate,
+                        'timeout_s': timeout,
+                        'device_latency_s': latency,
+                        'loop_period_s': loop_period,
+                        }
+                    result.update(measure(operation, meter, device.port, repeat))
+                    results.append(result)
+            finally:
+                meter.disconnect()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark round-trip latency of the mph Meter configuration protocol against simulated mph Meters.')
+    parser.add_argument('-o', '--operation', action='append', choices=list(OPERATIONS), help='Operation to benchmark (default: all).')
+    parser.add_argument('-b', '--baudrate', action='append', type=int, help='Baud rate (default: 9600).')
+    parser.add_argument('-t', '--timeout', action='append', type=float, help='Serial timeout in seconds (default: 0.9).')
+    parser.add_argument('-l', '--latency', action='append', type=float, help='Simulated device latency in seconds (default: 0).')
+    parser.add_argument('--loop-period', action='append', type=float, help='Simulated loop() period in seconds (default: 0.05).')
+    parser.add_argument('-n', '--repeat', type=int, default=20, help='Number of repetitions per operation.')
+    parser.add_argument('--output', help='Write JSON to file instead of stdout.')
+    args = parser.parse_args()
+
+    results = run(
+        args.operation or tuple(OPERATIONS),
+        args.baudrate or (9600,),
+        args.timeout or (0.9,),
+        args.latency or (0.0,),
+        args.loop_period or (0.05,),
+        args.repeat,
+        )
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,176 @@
+"""
+Build profile for the frozen (cx_Freeze) mph Meter Configurator.
+
+Instead of hand-written package and exclude lists, setup.py freezes exactly
+the modules an import trace shows to be used: all entry points and every
+module they import lazily are imported in a fresh interpreter and the
+resulting sys.modules is recorded. Standard library packages that never
+show up in the trace are excluded. The profile is written to
+build/build_profile.json (next to the frozen executables), so a build can be
+compared with the previous one.
+
+The start time of frozen executables can be measured as well:
+    python mph_meter_buildprofile.py trace
+    python mph_meter_buildprofile.py measure build/exe.win32-3.8/mph_meter_configurator.exe
+The first run of measure is the coldest one (executable and libraries not
+yet in the file cache of the operating system), the median of all other
+runs is reported separately.
+
+Required modules:
+-None
+"""
+
+#Used for command line interface (CLI)
+import argparse
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+#Modules the frozen application imports at start up or lazily later on
+TRACE_IMPORTS = [
+    'mph_meter_configurator',
+    'mph_meter_cli',
+    #Flash FW button (built-in programmer and avrdude)
+    'mph_meter_stk500',
+    'subprocess',
+    #Worker thread of the GUI (ThreadPoolExecutor is loaded lazily by concurrent.futures)
+    'concurrent.futures.thread',
+    #Port list of the GUI if the port watcher is not available
+    'serial.tools.list_ports',
+    ]
+
+#Modules that are frozen if they can be imported on the build machine
+OPTIONAL_IMPORTS = [
+    #Port watcher of the GUI (requires pyserial-asyncio)
+    'mph_meter_watcher',
+    ]
+
+#Never excluded, needed by the frozen interpreter itself (decoding, loading modules from the zip archive)
+KEEP = ['encodings', 'importlib', 'zipimport', 'zlib']
+
+#Environment variable making the GUI exit as soon as its window is shown (see mph_meter_configurator.py)
+STARTUP_TEST_ENV = 'MPH_METER_STARTUP_TEST'
+
+PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'build_profile.json')
+
+_TRACE_SCRIPT = '''
+import importlib, json, sys
+for name in {required!r}:
+    importlib.import_module(name)
+for name in {optional!r}:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+def trace(imports=TRACE_IMPORTS, optional=OPTIONAL_IMPORTS):
+    """Import all modules in a fresh interpreter and return sorted list of all modules loaded"""
+
+    script = _TRACE_SCRIPT.format(required=list(imports), optional=list(optional))
+    process = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+        )
+    return json.loads(process.stdout)
+
+
+def stdlib_names():
+    """Names of all top-level modules of the standard library"""
+
+    if hasattr(sys, 'stdlib_module_names'):
+        return set(sys.stdlib_module_names)
+
+    #Python older than 3.10: list the standard library directories
+    import pkgutil
+    import sysconfig
+
+    stdlib = sysconfig.get_paths()['stdlib']
+    paths = [stdlib, os.path.join(stdlib, 'lib-dynload'), os.path.join(sys.base_prefix, 'DLLs')]
+    return {module.name for module in pkgutil.iter_modules(paths)} | set(sys.builtin_module_names)
+
+
+def profile(modules, startup=()):
+    """Build profile (dict) for traced modules:
+    packages: top-level modules outside the standard library (this application and its dependencies)
+    excludes: top-level standard library modules that were not imported
+    startup: modules loaded by an empty interpreter (e.g. by site), they do not count as used unless they are part of the standard library"""
+
+    stdlib = stdlib_names()
+    used = {name.split('.')[0] for name in modules if name not in startup or name.split('.')[0] in stdlib} | set(KEEP)
+
+    return {
+        'python': '{}.{}'.format(*sys.version_info[:2]),
+        'platform': sys.platform,
+        'packages': sorted(name for name in used if name not in stdlib and name not in sys.builtin_module_names and name != '__main__'),
+        'excludes': sorted(name for name in stdlib - used if name not in sys.builtin_module_names),
+        'modules': modules,
+        }
+
+
+def load_profile(path=PROFILE):
+    """Build profile written by save_profile or None if there is none for the running Python version and platform"""
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if result.get('python') != '{}.{}'.format(*sys.version_info[:2]) or result.get('platform') != sys.platform:
+        return None
+    return result
+
+
+def save_profile(result, path=PROFILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=4, sort_keys=True)
+
+
+def measure(command, repeat=10, env=None):
+    """Start command repeat times and wait for it to exit. Returns dict of start up times in ms"""
+
+    env = dict(os.environ, **(env or {}))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'command': command,
+        'first_ms': times[0],
+        'median_ms': statistics.median(times[1:]) if len(times) > 1 else times[0],
+        'min_ms': min(times),
+        'runs': len(times),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trace imports for the frozen build and measure start up time of frozen executables.')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    subparsers.add_parser('trace', help='Trace imports and write {}.'.format(os.path.basename(PROFILE)))
+    measure_parser = subparsers.add_parser('measure', help='Measure start up time of an executable. GUI executables exit as soon as their window is shown.')
+    measure_parser.add_argument('-n', '--repeat', type=int, default=10, help='Number of runs.')
+    measure_parser.add_argument('command', nargs=argparse.REMAINDER, help='Executable and arguments (e.g. mph_meter_cli.exe --help).')
+    args = parser.parse_args()
+
+    if args.action == 'trace':
+        result = profile(trace(), trace([], []))
+        save_profile(result)
+        print('{} packages, {} standard library modules excluded, written to {}'.format(len(result['packages']), len(result['excludes']), PROFILE))
+    else:
+        if not args.command:
+            measure_parser.error('no executable given')
+        json.dump(measure(args.command, args.repeat, {STARTUP_TEST_ENV: '1'}), sys.stdout, indent=4)
+        print()
@@ -0,0 +1,147 @@
+"""
+Memory-mapped ring buffer file for long pulse recordings.
+
+The file consists of a 64 byte header followed by a fixed number of 16 byte
+records (timestamp in µs, interval in µs, device id, number of pulses lost
+by the mph Meter right before the pulse). When the file is full,
+the oldest records are overwritten. The header holds the total number of
+records ever written, which is updated after every record, so readers can
+map the same file (e.g. as NumPy array without copying) while the writer is
+still appending.
+
+Required modules:
+-numpy (only for CaptureReader)
+"""
+
+import mmap
+import struct
+
+#magic, format version, record size, capacity (records), total number of records written
+HEADER = struct.Struct('<4sHHIQ')
+HEADER_SIZE = 64
+MAGIC = b'MPHC'
+FORMAT_VERSION = 2
+#Offset of the record counter within the header
+COUNT_OFFSET = 12
+COUNT = struct.Struct('<Q')
+
+#timestamp_us, interval_us, device id, lost (see Pulse)
+RECORD = struct.Struct('<QIHH')
+
+
+class CaptureWriter():
+    """Append pulses to a ring buffer capture file"""
+
+    def __init__(self, path, capacity=1000000, device=0):
+        self.capacity = capacity
+        self.device = device
+        self.count = 0
+
+        with open(path, 'wb') as f:
+            f.truncate(HEADER_SIZE + capacity * RECORD.size)
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        HEADER.pack_into(self._map, 0, MAGIC, FORMAT_VERSION, RECORD.size, capacity, 0)
+
+    def append(self, timestamp_us, interval_us, device=None, lost=0):
+        """Append a single record. device defaults to the device id given at construction"""
+
+        offset = HEADER_SIZE + (self.count % self.capacity) * RECORD.size
+        RECORD.pack_into(self._map, offset, timestamp_us, interval_us, self.device if device is None else device, lost)
+        #Publish record only after it was written completely
+        self.count += 1
+        COUNT.pack_into(self._map, COUNT_OFFSET, self.count)
+
+    def extend(self, pulses, device=None):
+        """Append Pulse tuples (see MphMeter.stream)"""
+
+        for pulse in pulses:
+            self.append(pulse.timestamp_us, pulse.interval_us, device, pulse.lost)
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def capture(meter, path, capacity=1000000, device=0, duration=None):
+    """Record pulses streamed from a connected MphMeter into a capture file until duration seconds passed (or forever).
+    Returns the number of records written."""
+
+    with CaptureWriter(path, capacity, device) as writer:
+        try:
+            writer.extend(meter.stream(duration))
+        except KeyboardInterrupt:
+            pass
+        return writer.count
+
+
+class CaptureReader():
+    """Read a ring buffer capture file, also while it is still being written"""
+
+    def __init__(self, path):
+        import numpy as np
+
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, self.capacity, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError('{} is no mph Meter capture file'.format(path))
+
+        self.dtype = np.dtype([('timestamp_us', '<u8'), ('interval_us', '<u4'), ('device', '<u2'), ('lost', '<u2')])
+        #Zero-copy view of all record slots in file order (not in chronological order once the ring wrapped).
+        #Views taken from it keep the file mapped after close until they are garbage collected
+        self.ring = np.frombuffer(self._map, dtype=self.dtype, count=self.capacity, offset=HEADER_SIZE)
+
+    @property
+    def count(self):
+        """Total number of records written so far"""
+
+        return COUNT.unpack_from(self._map, COUNT_OFFSET)[0]
+
+    def snapshot(self, last=None):
+        """Copy of the last records (all available if last is None) in chronological order.
+        Records overwritten by the writer while copying are left out."""
+
+        import numpy as np
+
+        before = self.count
+        available = min(before, self.capacity)
+        if last is not None:
+            available = min(available, last)
+
+        first = before - available
+        start = first % self.capacity
+        if start + available <= self.capacity:
+            records = self.ring[start:start + available].copy()
+        else:
+            records = np.concatenate((self.ring[start:], self.ring[:start + available - self.capacity]))
+
+        #Drop records the writer may have overwritten in the meantime
+        overwritten = self.count - self.capacity - first
+        if overwritten > 0:
+            records = records[overwritten:]
+        return records
+
+    def close(self):
+        self.ring = None
+        try:
+            self._map.close()
+        except BufferError:
+            #Views of ring are still in use, the mapping is closed once the last one is garbage collected
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,101 @@
+"""
+Command line interface of the mph Meter Configurator.
+
+Programs and reads a single mph Meter without GUI. Only the model
+(mph_meter.py) is imported, tkinter is never loaded, so scripted
+provisioning starts quickly. The result is printed as JSON:
+    {"port": ..., "flashed": ..., "programmed": [...], "values": {...}} on success (exit code 0)
+    ("stats": {...} is added with --stats, see mph_meter_stats.py)
+    {"port": ..., "error": ...} on failure (exit code 1)
+
+Required modules:
+-pyserial (serial)
+"""
+
+#Used for command line interface (CLI)
+import argparse
+
+import json
+import sys
+
+from mph_meter import (
+    GREETING_TIMEOUT_S,
+    ReplyError,
+    BoundaryError,
+    NotConnectedError,
+    LostConnectionError,
+    MphMeter,
+    )
+
+#Keys of the values in the JSON output, in the order returned by MphMeter.read (same as the GUI uses)
+VALUE_KEYS = ['muempp_µm', 'debounce_ms', 'version', 'vwarn_v', 'vbat_v']
+
+
+def run(port, read=False, muempp=None, debounce=None, vcrit=None, default=False, flashfw=False, timeout=0.9, stats=False):
+    """Execute the requested operations in order: flash Firmware, restore defaults, programm values, read values.
+    Values are read if read is True or if nothing is programmed. If stats is True, the communication statistics are added.
+    Returns dict for JSON output.
+    Raises the exceptions of MphMeter"""
+
+    result = {'port': port}
+
+    if flashfw:
+        result['flashed'] = MphMeter.flash_fw(port)
+        if not result['flashed']:
+            raise ReplyError('Firmware update failed')
+
+    #After flashing, mph Meter only answers once it showed its greeting
+    meter = MphMeter(timeout=max(timeout, GREETING_TIMEOUT_S) if flashfw else timeout)
+    connected, reason = meter.connect(port)
+    if connected is not True:
+        raise NotConnectedError(reason)
+    meter.timeout = timeout
+
+    try:
+        programmed = [key for key, value in (('muempp_µm', muempp), ('debounce_ms', debounce), ('vwarn_v', vcrit)) if value is not None]
+        if default:
+            meter.set_defaults()
+        meter.set_many(muempp, debounce, vcrit)
+        result['programmed'] = (['defaults'] if default else []) + programmed
+
+        if read or not result['programmed']:
+            result['values'] = dict(zip(VALUE_KEYS, meter.read()))
+        if stats:
+            result['stats'] = meter.stats.snapshot()
+    finally:
+        meter.disconnect()
+
+    return result
+
+
+def main(argv=None):
+    """Parse command line, run it and print the result as JSON. Returns exit code"""
+
+    parser = argparse.ArgumentParser(description='Configure a mph Meter without GUI. The result is printed as JSON.')
+    parser.add_argument('-p', '--port', required=True, help='Serial port at which the mph Meter is connected.')
+    parser.add_argument('-r', '--read', action='store_true', help='Read values (default if nothing is programmed).')
+    parser.add_argument('-m', '--muempp', type=int, help='Programm µm/pulse value.')
+    parser.add_argument('-d', '--debounce', type=int, help='Programm additional Software debounce time value in miliseconds.')
+    parser.add_argument('-t', '--vcrit', type=float, help='Programm V(crit.) value in V.')
+    parser.add_argument('--default', action='store_true', help='Programm mph Meter defaults (before any other values).')
+    parser.add_argument('--flashfw', action='store_true', help='Flash Firmware to mph Meter (before anything else).')
+    parser.add_argument('--timeout', type=float, default=0.9, help='Reply timeout in seconds.')
+    parser.add_argument('--stats', action='store_true', help='Add latency and error statistics of the communication.')
+    args = parser.parse_args(argv)
+
+    try:
+        result = run(args.port, args.read, args.muempp, args.debounce, args.vcrit, args.default, args.flashfw, args.timeout, args.stats)
+    except (ReplyError, BoundaryError) as e:
+        result = {'port': args.port, 'error': e.text}
+    except NotConnectedError as e:
+        result = {'port': args.port, 'error': str(e) or 'Not connected'}
+    except LostConnectionError:
+        result = {'port': args.port, 'error': 'Connection to mph Meter lost'}
+
+    json.dump(result, sys.stdout, indent=4)
+    print()
+    return 1 if 'error' in result else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
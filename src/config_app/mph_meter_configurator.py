@@ -3,8 +3,8 @@
 __title__ = 'mph Meter Configurator'
 __description__ = 'Tool for configuring mph Meter written by Michael Fiederer'
 __author__ = 'Michael Fiederer'
-__version__ = '2.0'
-__date__ = '2020-04-10'
+__version__ = '2.1'
+__date__ = '2026-10-16'
 
 """
 Required modules:
@@ -25,6 +25,35 @@ Changelog:
         -Increased possibly SW debounce time from 999ms to 999.999ms
         -ToDo:
             -Add CLI
+    -2.1:
+        -Fixed MphMeter.connect referencing undefined test variable (now a keyword argument)
+        -Added AsyncMphMeter (mph_meter_async.py) for non-blocking communication with many mph Meters
+        -Added MphMeter.set_profile and fleet configuration of many serial ports at once (mph_meter_fleet.py)
+        -Added flashing Firmware to many mph Meters at once (mph_meter_flash.py)
+        -Batch flashing skips mph Meters already running the Firmware image (unless --force is given)
+        -Added built-in STK500v1 programmer (mph_meter_stk500.py), avrdude is no longer required for flashing Firmware
+        -Built-in programmer can write only the flash pages that changed (incremental flashing)
+        -Added MphMeter.stream for receiving raw pulse timestamps (requires mph Meter Firmware v0.3)
+        -Note: the bundled Firmware image (bin/mph_meter.ino.standard.hex) is still the v0.2 build and does not match
+         src/mph_meter_sketch (v0.6). Features requiring v0.3 or newer need the sketch built and the image replaced.
+        -Added vectorized speed computation for captured pulse streams (mph_meter_analysis.py, requires numpy)
+        -Added memory-mapped ring buffer capture files for long pulse recordings (mph_meter_capture.py)
+        -Added mph Meter simulator on pseudo terminals for testing and benchmarking without hardware (mph_meter_simulator.py)
+        -Added latency benchmark of the configuration protocol (mph_meter_benchmark.py)
+        -Added MphMeter.set_many, Restore Defaults now needs a single command (requires mph Meter Firmware v0.4)
+        -Added pipelined command execution (MphMeter.pipeline, MphMeter.read_many)
+        -Added baudrate negotiation (MphMeter.negotiate_baudrate, requires mph Meter Firmware v0.5)
+        -Added optional binary protocol with CRC checked frames (MphMeter.connect(binary=True), requires mph Meter Firmware v0.6)
+        -Port list is taken from a background port watcher instead of enumerating the ports on every click (mph_meter_watcher.py)
+        -MphMeter remembers the settings last read and updates them on every successful set command (MphMeter.read(vbat=False))
+        -Added MphMeter.apply_profile and MphMeter.apply_many, which skip values already programmed into the mph Meter
+        -GUI stays responsive while communicating with the mph Meter (serial communication runs in a worker thread, with progress bar and Cancel button)
+        -Added Live tab showing a chart of the speed measured by the mph Meter (mph_meter_live.py, requires mph Meter Firmware v0.3)
+        -Moved model into mph_meter.py, which does not depend on tkinter
+        -Added command line interface without GUI (mph_meter_cli.py)
+        -Faster startup: modules only needed by some functions are imported when used (see mph_meter_importtime.py)
+        -Frozen build only contains the modules found by an import trace, precompiled into a zip archive (mph_meter_buildprofile.py)
+        -Latency histograms, timeouts, reply errors and bytes per command of every connection, exportable as JSON or for Prometheus (mph_meter_stats.py)
             
 """
 
@@ -33,199 +62,33 @@ import tkinter as tk
 import tkinter.messagebox as messagebox
 import tkinter.ttk as ttk
 
-#Used for command line interface (CLI)
-import argparse
+#Used for start up time measurement
+import os
 
-#Used for running avrdude to update firmware
-import subprocess
-import os.path
+#Used for running serial communication in a worker thread, so the GUI stays responsive (concurrent.futures is imported by TkApp)
+import threading
 
-#Using pyserial for serial port communication
-import serial
-import serial.tools.list_ports as serialports
+#Model (mph_meter.py). DEFAULTS is still importable from this module for existing scripts
+from mph_meter import (
+    DEFAULTS,
+    ReplyError,
+    BoundaryError,
+    NotConnectedError,
+    LostConnectionError,
+    MphMeter,
+    )
+from mph_meter_live import SpeedHistory
 
-#Default values to programm into mph Meter when Restore Defaults button is clicked
-DEFAULTS = {
-    'muempp_µm': 43000,
-    'debounce_ms': 0,
-    'vwarn_v': 7.5,
-    }
+#Environment variable making the GUI exit as soon as its window is shown (see mph_meter_buildprofile.py)
+STARTUP_TEST_ENV = 'MPH_METER_STARTUP_TEST'
 
+#Interval in which the GUI checks for finished serial operations (ms)
+JOB_POLL_MS = 50
 
-#Exceptions
-class ReplyError(Exception):
-    """Raised when an invalid reply from mph Meter received"""
-    def __init__(self, text=None, value=None):
-        super().__init__()
-        self.text = text
-        self.value = value
-
-class BoundaryError(Exception):
-    """Raised when trying to set a value of the mph Meter that is out of boundaries"""
-    def __init__(self, text, value=None):
-        super().__init__()
-        self.text = text
-        self.value = value
-    def __str__(self):
-        return self.text + ' ({})'.format(repr(self.value))
-
-class NotConnectedError(Exception):
-    """Raised when an operation is performed on mph Meter, before it was connected"""
-    pass
-
-class LostConnectionError(Exception):
-    """Raised when connection to mph Meter is broken"""
-    pass
-
-
-#Model
-class MphMeter():
-    """Abstraction model / implementation of mph Meter"""
-    
-    def __init__(self):
-        self._serial = serial.Serial(baudrate=9600,timeout=0.9)
-
-    def _runcmd(self, cmd):
-        """Send command over serial port and return reply"""
-        
-        if not self._serial.is_open:
-            raise NotConnectedError
-        
-        try:
-            self._serial.write((cmd + '\n').encode('ascii'))
-            self._serial.flush()
-            reply = self._serial.read_until(b'\n').decode('ascii', errors='ignore').strip()
-        except serial.SerialException:
-            self._serial.close()
-            raise LostConnectionError
-            
-        return reply
-
-    def _setvalue(self, cmd, value, name, b_low, b_high, unit=''):
-        """Programm a value into mph Meter. Eveluate boundaries, evaluate reply from mph Meter and show success/fail dialogs accordingly"""
-        
-        if not self._serial.is_open:
-            raise NotConnectedError
-        
-        if not b_low <= value <= b_high:
-            raise BoundaryError('{name} must be between {b_low}{unit} and {b_high}{unit}!'.format(name=name, b_low=b_low, b_high=b_high, unit=unit), value)
-        
-        reply = self._runcmd(cmd)
-        
-        if reply == 'ERR':
-            raise ReplyError('Error setting {name} value'.format(name=name))
-        elif reply == '':
-            raise ReplyError('No reply received')
-        elif reply!= 'OK':
-            raise ReplyError('Incorrect reply received: {}'.format(repr(reply)))
-
-    def connect(self, port):
-        """Establish connection to physical mph Meter over serial port. Automatically disconnects from any previous connection."""
-
-        self.disconnect()
-
-        connected = False
-        reason = ''
-        
-        try:
-            self._serial.port = port
-            self._serial.open()
-        except serial.SerialException:
-            connected = False
-            reason = 'Could not open serial port'
-        else:
-            if test:
-                if self._runcmd('i') == 'mph Meter':
-                    connected = True
-                else:
-                    connected = False
-                    reason = 'mph Meter did not respond at given serial port'
-            else:
-                connected = True
-
-        if connected is not True and self._serial.is_open:
-            self._serial.close()
-
-        return connected, reason
-
-    def disconnect(self):
-        if self._serial.is_open:
-            self._serial.close()
-
-    @classmethod
-    def flash_fw(cls, port):
-        """Classmethod for programming Firmware into a potentially unprogrammed mph Meter. User has to press the Reset button on the Arduino and release it right after calling this function"""
-        
-        avrdude = subprocess.Popen(
-            [
-                os.path.abspath(os.path.join('.', 'avrdude', 'avrdude.exe')),
-                 '-C', os.path.abspath(os.path.join('.', 'avrdude', 'avrdude.conf')),
-                 '-v',
-                 '-p', 'atmega328p',
-                 '-c', 'arduino',
-                 '-P', '{}'.format(port),
-                 '-b', '115200',
-                 '-D',
-                 '-U', 'flash:w:{}:i'.format(os.path.abspath(os.path.join('.', 'mph_meter.ino.standard.hex'))),
-                 ],
-            encoding='ASCII',
-            errors='ignore'
-            )
-        
-        try:
-            avrdude.wait(10)
-        except subprocess.TimeoutExpired:
-            avrdude.kill()
-            return False
-
-        if avrdude.returncode != 0:
-            return False
-        else:
-            return True
-
-    def set_defaults(self):
-        """Programm mph Meter defaults"""
-        
-        self.set_debounce(DEFAULTS['debounce_ms'])
-        self.set_muempp(DEFAULTS['muempp_µm'])
-        self.set_vcrit(DEFAULTS['vwarn_v'])
-
-    def read(self):
-        """Read settings from mph Meter"""
-        
-        reply = self._runcmd('r')
-        parts = reply.split(';')
-        if len(parts) != 5:
-            raise ReplyError('Incorrect reply received (Number of items missmatched).', parts)
-
-        try:
-            parts[0] = int(parts[0])
-            parts[1] = int(parts[1])
-            parts[2] = str(parts[2])
-            parts[3] = float(parts[3])/1000
-            parts[4] = float(parts[4])/1000
-        except ValueError:
-            raise ReplyError('Could not convert data.', parts)
-
-        return parts
-
-    def set_debounce(self, value):
-        """Set additional software debounce time in miliseconds"""
-        
-        self._setvalue('d{:d}'.format(value), value, 'debounce time (ms)', 0, 999999, 'ms')
-
-    def set_muempp(self, value):
-        """Set µm/pulse"""
-        
-        self._setvalue('m{:d}'.format(value), value, 'µm per Pulse', 0, 999999999, 'µm/pulse')
-        
-    def set_vcrit(self, value):
-        """Set V(crit). If the supply voltage of the mph Meter is below this threshold during startup, a warning message will be displayed on the LCD"""
-        
-        self._setvalue('t{:d}'.format(int(value*1000)), value, 'V(crit)', 0, 15, 'V')
-
-    #Boolean var indicating wether an instance is connected or not
-    is_connected = property(lambda x: x._serial.is_open)
+#Live chart: time span shown (s), number of min/max buckets and minimum time between two redraws (ms)
+LIVE_SPAN_S = 60.0
+LIVE_BUCKETS = 300
+LIVE_REDRAW_MS = 250
 
 
 #View
@@ -238,9 +101,28 @@ class TkApp(tk.Tk):
         #Model instance
         self.mphmeter = MphMeter()
 
+        #All serial communication runs in a single worker thread, one operation after the other.
+        #Imported here, as it is slow to import and only needed by the GUI
+        import concurrent.futures
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        #Pending operations: (future, callback, cancel event)
+        self._jobs = []
+        #Progress reported by the running operation: (text, done, total) or None
+        self._progress = None
+
+        #Inventory of serial ports and mph Meters kept up to date in the background (requires pyserial-asyncio)
+        try:
+            from mph_meter_watcher import PortWatcher
+        except ImportError:
+            self.watcher = None
+        else:
+            self.watcher = PortWatcher().start()
+
         #tkinter variables
         self.variables = {
             'port': tk.StringVar(),
+            'status': tk.StringVar(),
+            'speed': tk.StringVar(),
             'version' : tk.StringVar(),
             'vbat_v' : tk.DoubleVar(),
             'muempp_µm' : tk.IntVar(),
@@ -252,43 +134,67 @@ class TkApp(tk.Tk):
         vcmd_int = (self.register(lambda x: self._validate_type(x, int)), '%P')
         vcmd_float = (self.register(lambda x: self._validate_type(x, float)), '%P')
 
+        #Tabs
+        self.notebook = ttk.Notebook(self)
+        settings = ttk.Frame(self.notebook)
+        live = ttk.Frame(self.notebook)
+        self.notebook.add(settings, text='Settings')
+        self.notebook.add(live, text='Live')
+
         #tkinter widgets
         self.widgets = {
             'port' : [
-                ttk.Label(self, text='COM-Port:'),
-                ttk.Combobox(self, textvariable=self.variables['port'], state='readonly', postcommand=self._refresh_ports),
-                ttk.Button(self, text='Connect', command=self._onconnect),
+                ttk.Label(settings, text='COM-Port:'),
+                ttk.Combobox(settings, textvariable=self.variables['port'], state='readonly', postcommand=self._refresh_ports),
+                ttk.Button(settings, text='Connect', command=self._onconnect),
                 ],
             'buttons' : [
-                ttk.Button(self, text='Read Values', command=self._read_values, state='disabled'),
-                ttk.Button(self, text='Restore Defaults', command=self._ondefault, state='disabled'),
-                ttk.Button(self, text='Flash FW', command=self._onfwupdate),
+                ttk.Button(settings, text='Read Values', command=self._read_values, state='disabled'),
+                ttk.Button(settings, text='Restore Defaults', command=self._ondefault, state='disabled'),
+                ttk.Button(settings, text='Flash FW', command=self._onfwupdate),
                 ],
             'version' : [
-                ttk.Label(self, text='SW Version:'),
-                ttk.Entry(self, state='disabled', textvariable=self.variables['version']),
+                ttk.Label(settings, text='SW Version:'),
+                ttk.Entry(settings, state='disabled', textvariable=self.variables['version']),
                 ],
             'vbat_V': [
-                ttk.Label(self, text='Battery Voltage:'),
-                ttk.Entry(self, state='disabled', textvariable=self.variables['vbat_v']),
+                ttk.Label(settings, text='Battery Voltage:'),
+                ttk.Entry(settings, state='disabled', textvariable=self.variables['vbat_v']),
                 ],
             'muempp_µm': [
-                ttk.Label(self, text='µm/pules (µm):'),
-                ttk.Spinbox(self, textvariable=self.variables['muempp_µm'], increment=1, from_=0, to=999999999, validate='key', validatecommand=vcmd_int),
-                ttk.Button(self, text='Set', command=lambda : self._setvalue(self.variables['muempp_µm'], self.mphmeter.set_muempp), state='disabled'),
+                ttk.Label(settings, text='µm/pules (µm):'),
+                ttk.Spinbox(settings, textvariable=self.variables['muempp_µm'], increment=1, from_=0, to=999999999, validate='key', validatecommand=vcmd_int),
+                ttk.Button(settings, text='Set', command=lambda : self._setvalue(self.variables['muempp_µm'], self.mphmeter.set_muempp), state='disabled'),
                 ],
             'debounce_ms': [
-                ttk.Label(self, text='SW debounce time (ms):'),
-                ttk.Spinbox(self, textvariable=self.variables['debounce_ms'], increment=1, from_=0, to=999999, validate='key', validatecommand=vcmd_int),
-                ttk.Button(self, text='Set', command=lambda : self._setvalue(self.variables['debounce_ms'], self.mphmeter.set_debounce), state='disabled'),
+                ttk.Label(settings, text='SW debounce time (ms):'),
+                ttk.Spinbox(settings, textvariable=self.variables['debounce_ms'], increment=1, from_=0, to=999999, validate='key', validatecommand=vcmd_int),
+                ttk.Button(settings, text='Set', command=lambda : self._setvalue(self.variables['debounce_ms'], self.mphmeter.set_debounce), state='disabled'),
                 ],
             'vwarn_v':[
-                ttk.Label(self, text='Battery warning threshold (V):'),
-                ttk.Spinbox(self, textvariable=self.variables['vwarn_v'], increment=0.1, from_=0, to=15, validate='key', validatecommand=vcmd_float),
-                ttk.Button(self, text='Set', command=lambda : self._setvalue(self.variables['vwarn_v'], self.mphmeter.set_vcrit), state='disabled'),
+                ttk.Label(settings, text='Battery warning threshold (V):'),
+                ttk.Spinbox(settings, textvariable=self.variables['vwarn_v'], increment=0.1, from_=0, to=15, validate='key', validatecommand=vcmd_float),
+                ttk.Button(settings, text='Set', command=lambda : self._setvalue(self.variables['vwarn_v'], self.mphmeter.set_vcrit), state='disabled'),
+                ],
+            'status': [
+                ttk.Label(self, textvariable=self.variables['status']),
+                ttk.Progressbar(self, mode='determinate'),
+                ttk.Button(self, text='Cancel', command=self._oncancel, state='disabled'),
                 ],
             }
 
+        #Live chart of the speed measured by mph Meter
+        self.history = SpeedHistory(LIVE_SPAN_S, LIVE_BUCKETS)
+        self.live_widgets = {
+            'chart': tk.Canvas(live, width=LIVE_BUCKETS * 2, height=200, background='white'),
+            'speed': ttk.Label(live, textvariable=self.variables['speed']),
+            'start': ttk.Button(live, text='Start', command=self._onlive, state='disabled'),
+            }
+        #Drawn as a single line zigzagging between minimum and maximum of every bucket
+        self._live_line = self.live_widgets['chart'].create_line(0, 0, 0, 0, fill='blue')
+        #Set to stop streaming, None while not streaming
+        self._live_stop = None
+
         #Widgets that will only be enabled when connected to mph Meter
         self._need_connection = [
             self.widgets['buttons'][0],
@@ -296,20 +202,30 @@ class TkApp(tk.Tk):
             self.widgets['muempp_µm'][2],
             self.widgets['debounce_ms'][2],
             self.widgets['vwarn_v'][2],
+            self.live_widgets['start'],
             ]
 
         #Grid widgets
         self.grid_columnconfigure(1, weight=1)
+        self.notebook.grid(row=0, column=0, columnspan=3, sticky='nesw')
+        settings.grid_columnconfigure(1, weight=1)
         for row, what in enumerate(self.widgets.items()):
             name, widgets = what
             for column, widget in enumerate(widgets):
-                widget.grid(row=row, column=column, sticky='nesw', padx=1, pady=1)
+                #The status row is shown below the tabs
+                widget.grid(row=row if name != 'status' else 1, column=column, sticky='nesw', padx=1, pady=1)
+        live.grid_columnconfigure(0, weight=1)
+        self.live_widgets['chart'].grid(row=0, column=0, columnspan=2, sticky='nesw', padx=1, pady=1)
+        self.live_widgets['speed'].grid(row=1, column=0, sticky='nesw', padx=1, pady=1)
+        self.live_widgets['start'].grid(row=1, column=1, sticky='nesw', padx=1, pady=1)
 
         #Window configuration
         self.title(__title__)
         self.center()
         self.resizable(False, False)
         self.after(100, lambda: messagebox.showinfo(__title__, 'Configuration Tool for mph Meter.\nWritten by {}.\nVersion {}'.format(__author__, __version__)))
+        self.after(JOB_POLL_MS, self._poll_jobs)
+        self.protocol('WM_DELETE_WINDOW', self._onclose)
 
     def center(self):
         """Place window in the middle of the first screen"""
@@ -320,6 +236,75 @@ class TkApp(tk.Tk):
         ypos = self.winfo_screenheight() // 2 - h // 2
         self.geometry('{}x{}+{}+{}'.format(w,h,xpos,ypos))
 
+    def _submit(self, func, on_done, text, cancel=None):
+        """Run func in the worker thread, so the window stays responsive. on_done(future) is called from the Tk main loop once func finished.
+        cancel: threading.Event set when the Cancel button is clicked (for operations that can be aborted)"""
+        
+        self._stop_live(cancel)
+        future = self._executor.submit(func)
+        self._jobs.append((future, on_done, cancel))
+        self._progress = None
+        self.variables['status'].set(text)
+        self.widgets['status'][1].configure(mode='indeterminate')
+        self.widgets['status'][1].start()
+        self.widgets['status'][2].configure(state='enabled')
+        return future
+
+    def _poll_jobs(self):
+        """Hand results of finished jobs over to their callbacks and update progress indication. Runs every JOB_POLL_MS"""
+        
+        #Scheduled first, so an exception in a callback does not stop polling
+        self.after(JOB_POLL_MS, self._poll_jobs)
+        
+        #One job per call, as callbacks showing dialogs run a nested main loop that polls again
+        for job in self._jobs:
+            if job[0].done():
+                self._jobs.remove(job)
+                future, on_done, cancel = job
+                if not future.cancelled():
+                    on_done(future)
+                break
+        
+        #Progress reported by the worker thread: (text, done, total)
+        progress = self._progress
+        if self._jobs and progress is not None:
+            text, done, total = progress
+            self.variables['status'].set(text)
+            self.widgets['status'][1].stop()
+            self.widgets['status'][1].configure(mode='determinate', maximum=total, value=done)
+        
+        if not self._jobs and self.widgets['status'][2].instate(['!disabled']):
+            self._progress = None
+            self.variables['status'].set('')
+            self.widgets['status'][1].stop()
+            self.widgets['status'][1].configure(mode='determinate', value=0)
+            self.widgets['status'][2].configure(state='disabled')
+
+    def _oncancel(self):
+        """Command for the Cancel button. Results of pending operations are dropped and the connection is closed,
+        as mph Meter may still answer a command that was already sent"""
+        
+        for future, on_done, cancel in self._jobs:
+            future.cancel()
+            if cancel is not None:
+                cancel.set()
+        self._jobs.clear()
+        self._disconnect()
+
+    def _onclose(self):
+        """Close window. Running operations are stopped and pending ones dropped, otherwise the interpreter would wait for the worker thread at exit
+        (streaming only ends once its stop event is set)"""
+        
+        self._stop_live()
+        for future, on_done, cancel in self._jobs:
+            if cancel is not None:
+                cancel.set()
+        self._jobs.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.destroy()
+
     def _onconnect(self):
         """Command for Connect Button"""
         
@@ -329,25 +314,42 @@ class TkApp(tk.Tk):
             messagebox.showwarning('ERROR', 'Select port before opening!')
             return
         
-        connected, reason = self.mphmeter.connect(port)
-        
-        if not connected is True:
-            messagebox.showerror('ERROR', reason)
-        else:
-            for widget in self._need_connection:
-                widget.configure(state='enabled')
+        def done(future):
+            connected, reason = future.result()
+            if not connected is True:
+                messagebox.showerror('ERROR', reason)
+            else:
+                for widget in self._need_connection:
+                    widget.configure(state='enabled')
                 
-            self._read_values()
-            messagebox.showinfo('Success', 'Successfully connected to Mph Meter at {}'.format(port))
+                self._read_values(on_success=lambda: messagebox.showinfo('Success', 'Successfully connected to Mph Meter at {}'.format(port)))
+        
+        self._submit(lambda: self.mphmeter.connect(port), done, 'Connecting to {}...'.format(port))
 
     def _disconnect(self):
         """Called upon communication loss to disable widgets that require an established connection"""
         
-        self.mphmeter.disconnect()
+        self._stop_live()
+        self._executor.submit(self.mphmeter.disconnect)
         
         for widget in self._need_connection:
             widget.configure(state='disabled')
 
+    def _handle_errors(self, future, reply_error_text):
+        """Return result of future. Shows error dialogs for the exceptions of MphMeter and returns None instead.
+        reply_error_text replaces the text of ReplyError"""
+        
+        try:
+            return future.result()
+        except ReplyError as e:
+            messagebox.showerror('ERROR', reply_error_text or e.text)
+        except (NotConnectedError, LostConnectionError):
+            messagebox.showerror('ERROR', 'Connection to mph Meter lost! Please reconnect.')
+            self._disconnect()
+        except BoundaryError as e:
+            messagebox.showerror('ERROR', e.text)
+        return None
+
     def _ondefault(self):
         """Command for the Restore Defaults button"""
         
@@ -355,17 +357,18 @@ class TkApp(tk.Tk):
             messagebox.showwarning('ERROR', 'Connect to mph Meter over COM-Port first!')
             return
 
-        try:
+        def run():
             self.mphmeter.set_defaults()
-            self._read_values()
-
-            messagebox.showinfo('Success', 'Restored Defaults')
-
-        except ReplyError as e:
-            messagebox.showerror('ERROR', e.text)
-        except LostConnectionError:
-            messagebox.showerror('ERROR', 'Connection to mph Meter lost! Please reconnect.')
-            self._disconnect()
+            #Settings are known from the set command, no need to read them again
+            return self.mphmeter.read(vbat=False)
+        
+        def done(future):
+            values = self._handle_errors(future, None)
+            if values is not None:
+                self._show_values(values)
+                messagebox.showinfo('Success', 'Restored Defaults')
+        
+        self._submit(run, done, 'Restoring defaults...')
 
     def _onfwupdate(self):
         """Command for the Flash FW button"""
@@ -377,39 +380,65 @@ class TkApp(tk.Tk):
             messagebox.showwarning('ERROR', 'Select port before opening!')
             return
 
-        messagebox.showwarning('Info', 'Press the RESET button of the ARDUINO and release it right after clicking the OK button.')
-
-        if MphMeter.flash_fw(port) is True:
-            messagebox.showinfo('Info', 'Firmware update successfull!\nPlease update values or restore defaults MANUALLY!')
-        else:
-            messagebox.showerror('ERROR', 'Firmware update failed!')
+        def progress(phase, page, count):
+            self._progress = ('Flashing Firmware ({})...'.format(phase), page, count)
+        
+        def flash(manual_reset):
+            if manual_reset:
+                messagebox.showwarning('Info', 'Press the RESET button of the ARDUINO and release it right after clicking the OK button.')
+            
+            def done(future):
+                if future.result() is True:
+                    messagebox.showinfo('Info', 'Firmware update successfull!\nPlease update values or restore defaults MANUALLY!')
+                elif not manual_reset and not cancel.is_set():
+                    #Boards without automatic reset (DTR) do not enter the bootloader on their own
+                    flash(True)
+                else:
+                    messagebox.showerror('ERROR', 'Firmware update failed!')
+            
+            cancel = threading.Event()
+            self._submit(lambda: MphMeter.flash_fw(port, progress=progress, cancel=cancel), done, 'Flashing Firmware...', cancel)
+        
+        #The built-in programmer tries the automatic reset first, the user is only asked to press RESET if that fails
+        flash(False)
 
-    def _read_values(self):
-        """Command for the Read Values button"""
+    def _read_values(self, vbat=True, on_success=None):
+        """Command for the Read Values button. With vbat=False, the remembered settings are shown if available (see MphMeter.read).
+        on_success is called after the values were shown"""
         
         if not self.mphmeter.is_connected:
             messagebox.showwarning('ERROR', 'Connect to mph Meter over COM-Port first!')
             return
 
-        try:
-            values = self.mphmeter.read()
-            
-            self.variables['muempp_µm'].set(values[0])
-            self.variables['debounce_ms'].set(values[1])
-            self.variables['version'].set(values[2])
-            self.variables['vwarn_v'].set(values[3])
-            self.variables['vbat_v'].set(values[4])
-            
-        except ReplyError as e:
-            messagebox.showerror('ERROR', e.text)
-        except LostConnectionError:
-            messagebox.showerror('ERROR', 'Connection to mph Meter lost! Please reconnect.')
-            self._disconnect()
+        def done(future):
+            values = self._handle_errors(future, None)
+            if values is not None:
+                self._show_values(values)
+                if on_success is not None:
+                    on_success()
+        
+        self._submit(lambda: self.mphmeter.read(vbat), done, 'Reading values...')
+
+    def _show_values(self, values):
+        """Fill entries with values returned by MphMeter.read"""
+        
+        self.variables['muempp_µm'].set(values[0])
+        self.variables['debounce_ms'].set(values[1])
+        self.variables['version'].set(values[2])
+        self.variables['vwarn_v'].set(values[3])
+        self.variables['vbat_v'].set(values[4])
 
     def _refresh_ports(self):
         """Refresh list of available serial ports for Combobox. Called every time the Combobox is clicked"""
         
-        self.widgets['port'][1].configure(values = [x.device for x in serialports.comports()])
+        if self.watcher is None:
+            import serial.tools.list_ports as serialports
+            ports = [x.device for x in serialports.comports()]
+        else:
+            #Taken from the inventory, ports with an identified mph Meter first
+            meters = self.watcher.meters
+            ports = sorted(self.watcher.ports, key=lambda port: (port not in meters, port))
+        self.widgets['port'][1].configure(values = ports)
 
     def _setvalue(self, var, setfunc):
         """Command for the Set buttons. (They use lambdas to fill the var and setfunc variables)"""
@@ -424,15 +453,66 @@ class TkApp(tk.Tk):
             messagebox.showwarning('ERROR', 'Fill field before setting value!')
             return
         
-        try:
-            setfunc(value)
-        except ReplyError:
-            messagebox.showerror('ERROR', 'Could not set new v_warn value!')
-        except LostConnectionError:
-            messagebox.showerror('ERROR', 'Connection to mph Meter lost! Please reconnect.')
-            self._disconnect()
-        except BoundaryError as e:
-            messagebox.showerror('ERROR', e.text)
+        self._submit(lambda: setfunc(value), lambda future: self._handle_errors(future, 'Could not set new v_warn value!'), 'Setting value...')
+
+    def _onlive(self):
+        """Command for the Start/Stop button of the Live tab"""
+        
+        if self._live_stop is not None:
+            self._live_stop.set()
+            return
+        
+        if not self.mphmeter.is_connected:
+            messagebox.showwarning('ERROR', 'Connect to mph Meter over COM-Port first!')
+            return
+        
+        stop = threading.Event()
+        
+        def run():
+            muempp = self.mphmeter.read(vbat=False)[0]
+            for pulse in self.mphmeter.stream(stop=stop):
+                self.history.add_pulse(pulse, muempp)
+        
+        def done(future):
+            stop.set()
+            self._handle_errors(future, None)
+        
+        self.history.clear()
+        self._live_stop = stop
+        self.live_widgets['start'].configure(text='Stop')
+        self._submit(run, done, 'Streaming pulses...', stop)
+        self._redraw_live()
+
+    def _stop_live(self, keep=None):
+        """Stop streaming (unless keep is its stop event), as it occupies the worker thread and other operations would wait for it forever"""
+        
+        if self._live_stop is not None and self._live_stop is not keep:
+            self._live_stop.set()
+
+    def _redraw_live(self):
+        """Draw live chart. Runs every LIVE_REDRAW_MS while streaming, independent of the rate pulses arrive at"""
+        
+        chart = self.live_widgets['chart']
+        width, height = chart.winfo_width(), chart.winfo_height()
+        buckets = self.history.snapshot()
+        
+        top = max((bucket[1] for bucket in buckets if bucket is not None), default=0.0) * 1.1 or 1.0
+        points = []
+        for index, bucket in enumerate(buckets):
+            if bucket is not None:
+                x = index * width / len(buckets)
+                points += [x, height - bucket[1] * height / top, x, height - bucket[0] * height / top]
+        chart.coords(self._live_line, *(points if points else [0, 0, 0, 0]))
+        
+        if self.history.last is not None:
+            self.variables['speed'].set('{:.1f} m/h (scale: {:.1f} m/h, {:.0f}s)'.format(self.history.last, top, self.history.span_s))
+        
+        if self._live_stop.is_set():
+            #Streaming was stopped (Stop or Cancel button, error)
+            self._live_stop = None
+            self.live_widgets['start'].configure(text='Start')
+        else:
+            self.after(LIVE_REDRAW_MS, self._redraw_live)
 
     def _validate_type(self, value, _type):
         """Function for input validation"""
@@ -446,20 +526,11 @@ class TkApp(tk.Tk):
             return False
         return True
 
-    def __del__(self):
-        self._serial.close()
-        super().__del__()
-
 if __name__ == '__main__':
-    """
-    parser = argparse.ArgumentParser(descpription=__despription__)
-    parser.add_argument('-p', '--port', action='store', choices=[x.device for x in serialports.comports()], required=True, help='Serial port at which the mph Meter is connected.')
-    parser.add_argument('--default', action='store_true', help='Programm mph Meter defaults.')
-    parser.add_argument('--flashfw', action='store_true', help='Flash Firmware to mph Meter.')
-    parser.add_argument('-m', '--muempp', action='store', help='Programm µm/pulse value.')
-    parser.add_argument('-d', '--debounce', action='store', help='Programm additional Software debounce time value in miliseconds.')
-    parser.add_argument('-r', '--read', action='store', help='Programm V(crit.) value.')
-    parser.add_argument('--version', action='version', version=__version__)
-    """
+    #For scripted use without GUI see mph_meter_cli.py
     app = TkApp()
-    app.mainloop()
+    if os.environ.get(STARTUP_TEST_ENV):
+        #Start up time measurement (see mph_meter_buildprofile.py), the window was already shown by center()
+        app._onclose()
+    else:
+        app.mainloop()
@@ -0,0 +1,99 @@
+"""
+Concurrent discovery of mph Meters.
+
+Every candidate serial port is probed with the i command at the same time,
+using a short timeout. Only ports answering "mph Meter" are reported,
+together with their Firmware version and settings. Searching a hub with many
+ports therefore takes about one timeout instead of one timeout per port.
+
+Required modules:
+-pyserial (serial)
+-pyserial-asyncio (serial_asyncio)
+"""
+
+#Used for command line interface (CLI)
+import argparse
+
+import asyncio
+import collections
+import json
+import sys
+
+#Using pyserial for serial port communication
+import serial.tools.list_ports as serialports
+
+from mph_meter import (
+    ReplyError,
+    NotConnectedError,
+    LostConnectionError,
+    )
+from mph_meter_async import AsyncMphMeter
+
+
+#Identified mph Meter
+#version: Firmware version reported by the mph Meter
+#values: settings as returned by MphMeter.read
+#serial_number: USB serial number of the port or None
+MeterInfo = collections.namedtuple('MeterInfo', ['port', 'version', 'values', 'serial_number'])
+
+
+def candidate_ports():
+    """Serial ports that may have a mph Meter connected. Returns dict of port name and USB serial number (or None)"""
+
+    return {info.device: info.serial_number or None for info in serialports.comports()}
+
+
+async def identify(port, timeout=0.3, serial_number=None):
+    """Identify the mph Meter at port. Returns MeterInfo or None if the port does not answer "mph Meter" """
+
+    meter = AsyncMphMeter(timeout=timeout)
+    try:
+        connected, reason = await meter.connect(port)
+        if connected is not True:
+            return None
+        values = await meter.read()
+        return MeterInfo(port, values[2], values, serial_number)
+    except (ReplyError, NotConnectedError, LostConnectionError):
+        return None
+    finally:
+        await meter.disconnect()
+
+
+async def _identify_port(port, serial_number, semaphore, timeout):
+    """identify, at most as many ports as the semaphore allows at once"""
+
+    async with semaphore:
+        return await identify(port, timeout, serial_number)
+
+
+async def discover_async(ports=None, workers=32, timeout=0.3):
+    """Probe all given ports (default: every serial port of the system) concurrently, at most workers ports at once.
+    ports may also be a dict of port name and USB serial number (see candidate_ports).
+    Returns a list of MeterInfo of the mph Meters found, in the same order as ports."""
+
+    if ports is None:
+        ports = candidate_ports()
+    if not isinstance(ports, dict):
+        ports = dict.fromkeys(ports)
+
+    semaphore = asyncio.Semaphore(workers)
+    results = await asyncio.gather(*[_identify_port(port, serial_number, semaphore, timeout) for port, serial_number in ports.items()])
+    return [result for result in results if result is not None]
+
+
+def discover(ports=None, workers=32, timeout=0.3):
+    """Blocking wrapper of discover_async for use outside of an event loop"""
+
+    return asyncio.run(discover_async(ports, workers, timeout))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find all mph Meters connected to this computer.')
+    parser.add_argument('ports', nargs='*', help='Serial ports to probe (default: all).')
+    parser.add_argument('-w', '--workers', type=int, default=32, help='Number of ports probed at the same time.')
+    parser.add_argument('-t', '--timeout', type=float, default=0.3, help='Reply timeout per port in seconds.')
+    args = parser.parse_args()
+
+    meters = discover(args.ports or None, args.workers, args.timeout)
+    json.dump([meter._asdict() for meter in meters], sys.stdout, indent=4)
+    print()
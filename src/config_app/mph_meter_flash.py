@@ -0,0 +1,241 @@
+"""
+Batch Firmware flashing of many mph Meters at once.
+
+All given serial ports are flashed concurrently, limited by a worker count.
+By default the built-in STK500v1 programmer (mph_meter_stk500.py) runs in a
+worker thread per port and reports its per-page progress. Alternatively
+avrdude is run, whose stdout/stderr are streamed line by line without
+blocking the others. Every port gets its own timeout.
+
+Flashing is skipped for mph Meters that already run the Firmware image:
+FW_CACHE records the SHA-256 digest of the hex file last flashed to every
+device (USB serial number, see mph_meter_stk500.device_id), also by the
+Flash FW button and mph_meter_cli.py (MphMeter.flash_fw), and the version
+string mph Meters report after being flashed with an image. Only if both the
+digest recorded for the device and the version it reports match, the 10
+second flash cycle is not needed. A rebuilt image reporting the same version
+is therefore still flashed to every device.
+
+Required modules:
+-pyserial (serial)
+-pyserial-asyncio (serial_asyncio)
+
+Required Software:
+-avrdude (only if use_avrdude is set, see MphMeter.avrdude_args)
+"""
+
+#Used for command line interface (CLI)
+import argparse
+
+import asyncio
+import collections
+import time
+
+#Using pyserial for serial port communication
+import serial
+
+from mph_meter import (
+    GREETING_TIMEOUT_S,
+    MphMeter,
+    ReplyError,
+    NotConnectedError,
+    LostConnectionError,
+    )
+from mph_meter_async import AsyncMphMeter
+import mph_meter_stk500 as stk500
+#Firmware cache, shared with MphMeter.flash_fw
+from mph_meter_stk500 import (
+    FW_CACHE,
+    hex_digest,
+    load_cache,
+    save_cache,
+    )
+
+
+
+#Result of flashing a single port
+#returncode: exit code of avrdude (0 or 1 for the built-in programmer) or None if it timed out, could not be started or was skipped
+#output: list of (stream name, line) tuples in the order they were received
+PortFlashResult = collections.namedtuple('PortFlashResult', ['port', 'returncode', 'timed_out', 'skipped', 'output', 'duration_s'])
+PortFlashResult.ok = property(lambda x: x.skipped or x.returncode == 0)
+
+
+async def probe_version(port, timeout=0.9):
+    """Return Firmware version reported by the mph Meter at port, or None if it did not answer"""
+
+    meter = AsyncMphMeter(timeout=timeout)
+    try:
+        connected, reason = await meter.connect(port)
+        if connected is not True:
+            return None
+        return (await meter.read())[2]
+    except (ReplyError, NotConnectedError, LostConnectionError):
+        return None
+    finally:
+        await meter.disconnect()
+
+
+async def _pump(port, name, stream, output, on_output):
+    """Read lines of stream until EOF and pass them on"""
+
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        line = line.decode('ascii', errors='ignore').rstrip()
+        output.append((name, line))
+        if on_output is not None:
+            on_output(port, name, line)
+
+
+async def _run_avrdude(port, timeout, output, on_output):
+    """Run avrdude for a single port. Returns (returncode, timed_out)"""
+
+    try:
+        avrdude = await asyncio.create_subprocess_exec(
+            *MphMeter.avrdude_args(port),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            )
+    except OSError as e:
+        output.append(('error', str(e)))
+        return None, False
+
+    pumps = asyncio.gather(
+        _pump(port, 'stdout', avrdude.stdout, output, on_output),
+        _pump(port, 'stderr', avrdude.stderr, output, on_output),
+        )
+
+    try:
+        await asyncio.wait_for(asyncio.gather(pumps, avrdude.wait()), timeout)
+    except asyncio.TimeoutError:
+        avrdude.kill()
+        await avrdude.wait()
+        return None, True
+
+    return avrdude.returncode, False
+
+
+async def _run_stk500(port, timeout, output, on_output, incremental):
+    """Run the built-in programmer for a single port in a worker thread. Returns (returncode, timed_out)"""
+
+    loop = asyncio.get_running_loop()
+    deadline = time.perf_counter() + timeout
+
+    def emit(name, line):
+        output.append((name, line))
+        if on_output is not None:
+            loop.call_soon_threadsafe(on_output, port, name, line)
+
+    def progress(phase, page, page_count):
+        emit('progress', '{} page {}/{}'.format(phase, page, page_count))
+        #A thread can not be killed, so the timeout is enforced between pages
+        if time.perf_counter() > deadline:
+            raise TimeoutError
+
+    def run():
+        try:
+            written = stk500.flash(port, progress=progress, incremental=incremental)
+        except TimeoutError:
+            return None, True
+        except (stk500.ReplyError, stk500.LostConnectionError, serial.SerialException, OSError, ValueError) as e:
+            emit('error', getattr(e, 'text', None) or str(e) or type(e).__name__)
+            return 1, False
+        emit('info', '{} pages written'.format(written))
+        return 0, False
+
+    return await loop.run_in_executor(None, run)
+
+
+async def _flash_port(port, device, semaphore, timeout, on_output, digest, cache, force, use_avrdude, incremental):
+    """Flash a single port (unless it already runs the Firmware image) and collect the programmer's output"""
+
+    async with semaphore:
+        start = time.perf_counter()
+        output = []
+
+        if not force and cache['devices'].get(device) == digest and digest in cache['images']:
+            version = await probe_version(port)
+            if version == cache['images'][digest]:
+                output.append(('info', 'Firmware {} already installed'.format(version)))
+                return PortFlashResult(port, None, False, True, output, time.perf_counter() - start)
+
+        #A failed or aborted flash leaves the device in an unknown state
+        cache['devices'].pop(device, None)
+
+        if use_avrdude:
+            #The image avrdude writes is not known to the flash cache of the built-in programmer
+            stk500.store_cached_image(device, None)
+            returncode, timed_out = await _run_avrdude(port, timeout, output, on_output)
+        else:
+            returncode, timed_out = await _run_stk500(port, timeout, output, on_output, incremental)
+
+        #Remember which version this image reports. The mph Meter shows its greeting after reset, so allow a long timeout
+        if returncode == 0:
+            cache['devices'][device] = digest
+            version = await probe_version(port, timeout=GREETING_TIMEOUT_S)
+            if version is not None:
+                cache['images'][digest] = version
+
+        return PortFlashResult(port, returncode, timed_out, False, output, time.perf_counter() - start)
+
+
+async def flash_fleet_async(ports, workers=4, timeout=10, on_output=None, force=False, cache_path=FW_CACHE, use_avrdude=False, incremental=None):
+    """Flash Firmware into the mph Meters at all given ports, at most workers ports at once.
+    mph Meters already running the Firmware image are skipped unless force is True.
+    on_output(port, stream, line) is called for every line of programmer output (avrdude or per-page progress).
+    incremental is passed on to the built-in programmer (see mph_meter_stk500.flash).
+    Returns a list of PortFlashResult in the same order as ports."""
+
+    digest = hex_digest()
+    cache = load_cache(cache_path)
+    devices = stk500.device_ids(ports)
+
+    semaphore = asyncio.Semaphore(workers)
+    results = await asyncio.gather(*[_flash_port(port, devices[port], semaphore, timeout, on_output, digest, cache, force, use_avrdude, incremental) for port in ports])
+
+    save_cache(cache, cache_path)
+    return results
+
+
+def flash_fleet(ports, workers=4, timeout=10, on_output=None, force=False, cache_path=FW_CACHE, use_avrdude=False, incremental=None):
+    """Blocking wrapper of flash_fleet_async for use outside of an event loop"""
+
+    return asyncio.run(flash_fleet_async(ports, workers, timeout, on_output, force, cache_path, use_avrdude, incremental))
+
+
+def summary(results):
+    """Human readable report of a list of PortFlashResult"""
+
+    lines = []
+    for result in results:
+        if result.skipped:
+            status = 'UP TO DATE'
+        elif result.ok:
+            status = 'OK'
+        elif result.timed_out:
+            status = 'TIMEOUT'
+        elif result.returncode is None:
+            status = 'NOT STARTED'
+        else:
+            status = 'FAILED ({})'.format(result.returncode)
+        lines.append('{:<20} {:<12} {:6.1f}s'.format(result.port, status, result.duration_s))
+
+    succeeded = sum(1 for result in results if result.ok)
+    skipped = sum(1 for result in results if result.skipped)
+    lines.append('{} of {} mph Meters flashed successfully ({} already up to date)'.format(succeeded, len(results), skipped))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flash Firmware to many mph Meters at once.')
+    parser.add_argument('ports', nargs='+', help='Serial ports at which the mph Meters are connected.')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Number of mph Meters flashed at the same time.')
+    parser.add_argument('-t', '--timeout', type=float, default=10, help='Timeout per mph Meter in seconds.')
+    parser.add_argument('--force', action='store_true', help='Flash even if a mph Meter already runs the Firmware image.')
+    parser.add_argument('--avrdude', action='store_true', help='Use avrdude instead of the built-in programmer.')
+    parser.add_argument('--incremental', choices=['readback', 'cache'], help='Only write flash pages that changed, compared to the read back flash or the image last flashed to the mph Meter.')
+    args = parser.parse_args()
+
+    results = flash_fleet(args.ports, args.workers, args.timeout, force=args.force, use_avrdude=args.avrdude, incremental=args.incremental)
+    print(summary(results))
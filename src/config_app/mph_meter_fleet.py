@@ -0,0 +1,79 @@
+"""
+Fleet configuration of many mph Meters at once.
+
+A settings profile (dict with the same keys as DEFAULTS) is programmed into
+all given serial ports concurrently. Only values that differ from the
+current settings of a mph Meter are written, so re-provisioning a fleet
+that is already up to date only reads. The number of ports worked on at the
+same time is limited by a worker count, so the wall-clock time grows with
+the slowest mph Meter instead of the sum of all of them.
+
+Required modules:
+-pyserial (serial)
+-pyserial-asyncio (serial_asyncio)
+"""
+
+import asyncio
+import collections
+import time
+
+from mph_meter import (
+    DEFAULTS,
+    ReplyError,
+    BoundaryError,
+    NotConnectedError,
+    LostConnectionError,
+    MphMeter,
+    )
+from mph_meter_async import AsyncMphMeter
+
+
+#Result of configuring a single port
+#values: settings read back after programming (see MphMeter.read) or None
+#error: exception that occured or None
+#duration_s: time spent on that port including connecting
+#skipped: profile keys that were already programmed and therefore not written
+PortResult = collections.namedtuple('PortResult', ['port', 'values', 'error', 'duration_s', 'skipped'])
+PortResult.ok = property(lambda x: x.error is None)
+
+
+async def _configure_port(port, profile, semaphore, timeout):
+    """Connect to a single mph Meter, programm the values of profile that changed and read values back"""
+
+    async with semaphore:
+        start = time.perf_counter()
+        meter = AsyncMphMeter(timeout=timeout)
+        values = None
+        error = None
+        skipped = []
+
+        try:
+            connected, reason = await meter.connect(port)
+            if connected is not True:
+                raise NotConnectedError(reason)
+            skipped = await meter.apply_profile(profile)
+            values = await meter.read()
+        except (ReplyError, BoundaryError, NotConnectedError, LostConnectionError) as e:
+            error = e
+        finally:
+            await meter.disconnect()
+
+        return PortResult(port, values, error, time.perf_counter() - start, skipped)
+
+
+async def configure_fleet_async(ports, profile=DEFAULTS, workers=8, timeout=0.9):
+    """Programm profile into the mph Meters at all given ports, at most workers ports at once.
+    Returns a list of PortResult in the same order as ports.
+    Raises BoundaryError or ValueError for an invalid profile before any port is opened."""
+
+    #Same checks as every single port would do, so an invalid profile does not abort the batch halfway
+    MphMeter._manycmd(MphMeter._profilevalues(profile))
+
+    semaphore = asyncio.Semaphore(workers)
+    return await asyncio.gather(*[_configure_port(port, profile, semaphore, timeout) for port in ports])
+
+
+def configure_fleet(ports, profile=DEFAULTS, workers=8, timeout=0.9):
+    """Blocking wrapper of configure_fleet_async for use outside of an event loop"""
+
+    return asyncio.run(configure_fleet_async(ports, profile, workers, timeout))
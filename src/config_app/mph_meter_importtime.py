@@ -0,0 +1,81 @@
+"""
+Import time measurement of the mph Meter modules.
+
+Every module is imported in a fresh interpreter with "python -X importtime"
+several times. The cumulative import time of the module (including
+everything it imports) and the wall-clock time of the whole interpreter run
+are emitted as JSON, together with the heaviest modules imported (their
+cumulative times overlap, as they include nested imports).
+
+Bytecode has to be up to date (python -m compileall), otherwise compiling
+is measured as well.
+
+Required modules:
+-None
+"""
+
+#Used for command line interface (CLI)
+import argparse
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+#Entry points whose startup time matters
+MODULES = [
+    'mph_meter',
+    'mph_meter_cli',
+    'mph_meter_configurator',
+    ]
+
+
+def parse_importtime(output):
+    """Parse stderr of "python -X importtime" into dict of module name and cumulative import time in µs"""
+
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+
+def measure(module, repeat=5, top=5):
+    """Import module repeat times in a fresh interpreter. Returns dict of median times in ms and the top heaviest imports"""
+
+    imports = []
+    totals = []
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)], capture_output=True, text=True)
+        totals.append((time.perf_counter() - start) * 1000)
+        if process.returncode != 0:
+            raise ImportError('Could not import {}:\n{}'.format(module, process.stderr))
+        times = parse_importtime(process.stderr)
+        imports.append(times[module] / 1000)
+        runs.append(times)
+
+    #Heaviest top-level imports of the median run, without the module itself
+    median_run = runs[imports.index(sorted(imports)[len(imports) // 2])]
+    heaviest = sorted(((name, us / 1000) for name, us in median_run.items() if name != module and '.' not in name), key=lambda x: -x[1])
+
+    return {
+        'module': module,
+        'import_ms': statistics.median(imports),
+        'interpreter_ms': statistics.median(totals),
+        'heaviest_ms': dict(heaviest[:top]),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure import time of the mph Meter modules.')
+    parser.add_argument('modules', nargs='*', help='Modules to measure (default: {}).'.format(', '.join(MODULES)))
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='Number of fresh interpreters per module.')
+    args = parser.parse_args()
+
+    json.dump([measure(module, args.repeat) for module in args.modules or MODULES], sys.stdout, indent=4)
+    print()
@@ -0,0 +1,90 @@
+"""
+Fixed-size history of the speed measured by a mph Meter, for live charts.
+
+Speeds are collected in a ring buffer of time buckets. Each bucket only
+holds the minimum and maximum speed of the pulses within it (min/max
+decimation), so adding a pulse and taking a snapshot for drawing cost the
+same no matter for how long pulses have been streamed (see MphMeter.stream).
+
+Required modules:
+-pyserial (serial), imported by mph_meter.py
+"""
+
+import threading
+
+from mph_meter import SPEED_FACTOR
+
+
+def pulse_speed(pulse, muempp):
+    """Speed in m/h of the interval ending with pulse (see MphMeter.stream) or None for the first pulse.
+    Pulses lost by the mph Meter are included in the interval"""
+
+    if pulse.interval_us <= 0:
+        return None
+    return muempp * (pulse.lost + 1) * SPEED_FACTOR / pulse.interval_us
+
+
+class SpeedHistory():
+    """Minimum and maximum speed per time bucket over the last span_s seconds. Thread-safe"""
+
+    def __init__(self, span_s=60.0, buckets=300):
+        self.span_s = span_s
+        self.buckets = buckets
+        self._bucket_us = span_s * 1e6 / buckets
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Forget all speeds"""
+
+        with self._lock:
+            self._min = [None] * self.buckets
+            self._max = [None] * self.buckets
+            #Absolute index of the newest bucket
+            self._head = None
+            #Most recent speed added
+            self.last = None
+
+    def add(self, timestamp_us, speed):
+        """Add speed measured at timestamp_us (timestamps must not decrease by more than span_s)"""
+
+        index = int(timestamp_us // self._bucket_us)
+
+        with self._lock:
+            if self._head is None:
+                self._head = index
+            elif index > self._head:
+                #Empty the buckets passed since the last pulse, at most all of them
+                for passed in range(self._head + 1, min(index, self._head + self.buckets) + 1):
+                    self._min[passed % self.buckets] = None
+                    self._max[passed % self.buckets] = None
+                self._head = index
+            elif index <= self._head - self.buckets:
+                return
+
+            slot = index % self.buckets
+            if self._min[slot] is None:
+                self._min[slot] = self._max[slot] = speed
+            else:
+                self._min[slot] = min(self._min[slot], speed)
+                self._max[slot] = max(self._max[slot], speed)
+            self.last = speed
+
+    def add_pulse(self, pulse, muempp):
+        """Add speed of a Pulse (see MphMeter.stream and pulse_speed)"""
+
+        speed = pulse_speed(pulse, muempp)
+        if speed is not None:
+            self.add(pulse.timestamp_us, speed)
+
+    def snapshot(self):
+        """List of (min, max) speed of every bucket, oldest first. None for buckets without pulses"""
+
+        with self._lock:
+            if self._head is None:
+                return [None] * self.buckets
+            first = self._head + 1
+            return [
+                None if self._min[index % self.buckets] is None else (self._min[index % self.buckets], self._max[index % self.buckets])
+                for index in range(first, first + self.buckets)
+                ]
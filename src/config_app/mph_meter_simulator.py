@@ -0,0 +1,453 @@
+"""
+mph Meter simulator on a pseudo terminal (Linux only).
+
+SimulatedMeter emulates the serial protocol of the mph Meter Firmware
+(mph_meter_sketch.ino) closely enough to benchmark and test the
+configurator without hardware:
+-serialEvent() is only run every loop_period seconds, like loop() does with delay(50)
+-hardware serial rx buffer of 64 bytes, bytes received while it is full are lost
+-rx buffer (12 bytes before v0.4, 32 bytes since), including the ERR reply when it overflows
+-r/m/d/t/i/s/a/b commands with the same boundaries and strtoul() parsing
+-baudrate negotiation: when throttling is enabled, replies are throttled to the negotiated baudrate
+-binary frames with CRC-16 (v0.6), including the discarding of incomplete frames after 500 ms
+-older Firmware versions (commands they do not know are answered with ERR)
+-EEPROM contents are persisted to a file (optional)
+-synthetic pulses with debouncing and the 32 entry streaming ring buffer
+
+The port name of every instance can be passed to MphMeter.connect.
+
+Required modules:
+-None
+"""
+
+#Used for command line interface (CLI)
+import argparse
+
+import binascii
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+VERSION = '0.6'
+
+#Layout of struct eepdata: muem_per_pulse, debounce_time_ms, bat_critical_mv
+EEPDATA = struct.Struct('<LLL')
+ULONG_MAX = 0xFFFFFFFF
+
+BAUDRATES = (9600, 19200, 38400, 57600, 115200, 250000, 500000, 1000000)
+BAUDRATE_CONFIRM_S = 1.0
+
+#Arduino HardwareSerial ring buffer, one slot stays free
+HW_RX_BUFFER = 63
+STREAM_BUF_SIZE = 32
+STREAM_HEADER = 0xA5
+
+FRAME_START = 0x7E
+FRAME_TIMEOUT_S = 0.5
+FRAME_OK = 0
+FRAME_ERR = 1
+FRAME_CRC_ERR = 2
+#Upper limits of muem_per_pulse, debounce_time_ms, bat_critical_mv
+LIMITS = (999999999, 999999, 15000)
+
+
+def strtoul(data):
+    """Emulation of strtoul(data, &end, 10) of avr-libc for unsigned long (32 bit). Returns value and end position"""
+
+    pos = 0
+    while pos < len(data) and data[pos:pos + 1] in b' \t\n\v\f\r':
+        pos += 1
+
+    negative = False
+    if data[pos:pos + 1] in (b'+', b'-'):
+        negative = data[pos:pos + 1] == b'-'
+        pos += 1
+
+    value = 0
+    digits = pos
+    while pos < len(data) and 0x30 <= data[pos] <= 0x39:
+        value = value * 10 + data[pos] - 0x30
+        pos += 1
+
+    #No digits: end points to the beginning of the string
+    if pos == digits:
+        return 0, 0
+
+    if value > ULONG_MAX:
+        return ULONG_MAX, pos
+    return ((-value) & ULONG_MAX if negative else value), pos
+
+
+class SimulatedMeter():
+    """Simulated mph Meter behind a pseudo terminal"""
+
+    def __init__(self, eeprom=None, latency=0.0, baudrate=None, loop_period=0.05, pulse_hz=0.0, jitter=0.0, vbat_v=9.0, version=VERSION):
+        """eeprom: file persisting the EEPROM contents (a new mph Meter has an erased EEPROM, all bits set)
+        latency: additional delay in seconds before every reply
+        baudrate: throttle replies to the given baudrate (None: as fast as possible)
+        loop_period: time between two loop() cycles, serialEvent() is only evaluated once per cycle
+        pulse_hz: rate of synthetic pulses at the input pin, jitter: standard deviation of the pulse period (fraction)
+        vbat_v: simulated supply voltage
+        version: simulated Firmware version"""
+
+        self.eeprom = eeprom
+        self.latency = latency
+        self.baudrate = baudrate
+        self.loop_period = loop_period
+        self.pulse_hz = pulse_hz
+        self.jitter = jitter
+        self.vbat_v = vbat_v
+        self.version = version
+        self._default_baudrate = baudrate
+        self._baudrate_switch = None
+        self._version = tuple(int(part) for part in version.split('.'))
+
+        #Statistics
+        self.eeprom_writes = 0
+        self.commands = 0
+        self.rx_dropped = 0
+
+        self.stored_vars = [ULONG_MAX, ULONG_MAX, ULONG_MAX]
+        if eeprom is not None and os.path.exists(eeprom):
+            with open(eeprom, 'rb') as f:
+                self.stored_vars = list(EEPDATA.unpack(f.read(EEPDATA.size)))
+
+        self._rx_size = 32 if self._version >= (0, 4) else 12
+        #One byte more, as serialEvent() writes one byte past the buffer before detecting the overflow
+        self._rx_buf = bytearray(self._rx_size + 1)
+        self._rx_pos = 0
+        self._frame_time = 0.0
+
+        self._streaming = False
+        self._stream_buf = []
+        self._stream_seq = 0
+        self._last_pulse = 0
+        self._next_pulse = None
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._boot = time.monotonic()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Run simulation in a background thread"""
+
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop simulation and close pseudo terminal"""
+
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _write(self, data):
+        """Serial.write"""
+
+        if self.latency:
+            time.sleep(self.latency)
+        os.write(self._master, data)
+        if self.baudrate:
+            #8N1: 10 bits per byte on the wire
+            time.sleep(len(data) * 10 / self.baudrate)
+
+    def _eeprom_put(self):
+        """EEPROM.put(0, stored_vars)"""
+
+        self.eeprom_writes += 1
+        if self.eeprom is not None:
+            with open(self.eeprom, 'wb') as f:
+                f.write(EEPDATA.pack(*self.stored_vars))
+
+    def _read_vbat(self):
+        """read_vbat(), including the quantization of the 10 bit ADC"""
+
+        adc = max(0, min(1023, int(self.vbat_v / 10.0 * 1024)))
+        return 10.0 * adc / 1024.0
+
+    def _loop(self):
+        """loop(): evaluate received bytes, feed synthetic pulses and flush the streaming ring buffer every cycle"""
+
+        last_rx = time.monotonic()
+
+        while self._running:
+            if self.loop_period:
+                time.sleep(self.loop_period)
+            else:
+                select.select([self._master], [], [], 0.05)
+
+            self._generate_pulses()
+
+            readable, _, _ = select.select([self._master], [], [], 0)
+            if readable:
+                #With a throttled wire, only the bytes that could have arrived since the last cycle are received
+                now = time.monotonic()
+                size = 4096 if not self.baudrate else max(1, int((now - last_rx) * self.baudrate / 10))
+                last_rx = now
+                try:
+                    data = os.read(self._master, size)
+                except OSError:
+                    return
+                if len(data) > HW_RX_BUFFER:
+                    self.rx_dropped += len(data) - HW_RX_BUFFER
+                    data = data[:HW_RX_BUFFER]
+                self._serial_event(data)
+            else:
+                last_rx = time.monotonic()
+
+            if self._streaming:
+                self._stream_flush()
+
+            #Discard incomplete binary frame
+            if self._rx_buf[0] == FRAME_START and time.monotonic() - self._frame_time > FRAME_TIMEOUT_S:
+                self._rx_pos = 0
+                self._rx_buf[:] = bytes(len(self._rx_buf))
+
+            if self._baudrate_switch is not None and time.monotonic() - self._baudrate_switch > BAUDRATE_CONFIRM_S:
+                self._baudrate_switch = None
+                if self.baudrate:
+                    self.baudrate = self._default_baudrate
+
+    def _serial_event(self, data):
+        """serialEvent(), byte by byte as implemented in the Firmware"""
+
+        for char in data:
+            self._rx_buf[self._rx_pos] = char
+
+            #Binary frame. FRAME_START never starts a text command
+            if self._version >= (0, 6) and self._rx_buf[0] == FRAME_START:
+                if self._rx_pos == 0:
+                    self._frame_time = time.monotonic()
+                self._rx_pos += 1
+                if self._rx_pos >= 2 and self._rx_buf[1] + 4 > self._rx_size:
+                    #Frame would not fit into buffer
+                    self._rx_pos = 0
+                    self._rx_buf[:] = bytes(len(self._rx_buf))
+                    self._send_frame(0, FRAME_ERR)
+                elif self._rx_pos >= 2 and self._rx_pos == self._rx_buf[1] + 4:
+                    self.commands += 1
+                    self._handle_frame(bytes(self._rx_buf[:self._rx_pos]))
+                    self._rx_pos = 0
+                    self._rx_buf[:] = bytes(len(self._rx_buf))
+                continue
+
+            if self._rx_buf[self._rx_pos] == ord('\n'):
+                self.commands += 1
+                self._evaluate(bytes(self._rx_buf))
+                self._rx_pos = 0
+                self._rx_buf[:] = bytes(len(self._rx_buf))
+
+            if self._rx_pos >= self._rx_size:
+                self._rx_pos = 0
+                self._rx_buf[:] = bytes(len(self._rx_buf))
+                self._write(b'ERR\n')
+
+            if self._rx_buf[self._rx_pos] != 0:
+                self._rx_pos += 1
+
+    def _evaluate(self, buf):
+        """Evaluate a complete command in the rx buffer"""
+
+        cmd = buf[0:1]
+
+        if cmd == b'r':
+            self._write('{:d};{:d};{};{:d};{:d}\n'.format(
+                self.stored_vars[0], self.stored_vars[1], self.version, self.stored_vars[2], int(self._read_vbat() * 1000)
+                ).encode('ascii'))
+        elif cmd in (b'm', b'd', b't'):
+            index = b'mdt'.index(cmd)
+            value, end = strtoul(buf[1:])
+            if value > LIMITS[index]:
+                self._write(b'ERR\n')
+            else:
+                self.stored_vars[index] = value
+                self._eeprom_put()
+                self._write(b'OK\n')
+        elif cmd == b'a' and self._version >= (0, 4):
+            new_vars = list(self.stored_vars)
+            pos = 1
+            valid = True
+            for index in range(3):
+                if buf[pos:pos + 1] not in (b';', b'\n'):
+                    value, end = strtoul(buf[pos:])
+                    if end == 0 or value > LIMITS[index]:
+                        valid = False
+                    else:
+                        new_vars[index] = value
+                    pos += end
+                if index < 2:
+                    if buf[pos:pos + 1] == b';':
+                        pos += 1
+                    else:
+                        valid = False
+            if valid and buf[pos:pos + 1] == b'\n':
+                self.stored_vars = new_vars
+                self._eeprom_put()
+                self._write(b'OK\n')
+            else:
+                self._write(b'ERR\n')
+        elif cmd == b's' and self._version >= (0, 3):
+            if buf[1:2] == b'1':
+                self._stream_buf = []
+                self._streaming = True
+                self._write(b'OK\n')
+            elif buf[1:2] == b'0':
+                self._streaming = False
+                self._stream_flush()
+                self._write(b'OK\n')
+            else:
+                self._write(b'ERR\n')
+        elif cmd == b'b' and self._version >= (0, 5):
+            value, end = strtoul(buf[1:])
+            if value not in BAUDRATES:
+                self._write(b'ERR\n')
+            else:
+                self._write(b'OK\n')
+                if self.baudrate:
+                    self.baudrate = value
+                self._baudrate_switch = time.monotonic() if value != 9600 else None
+        elif cmd == b'i':
+            self._baudrate_switch = None
+            self._write(b'mph Meter\n')
+        else:
+            self._write(b'ERR\n')
+
+    def _send_frame(self, cmd, status, data=b''):
+        """send_frame(): 0x7E, length, command, status, data, CRC-16"""
+
+        body = bytes([len(data) + 2, cmd, status]) + data
+        self._write(bytes([FRAME_START]) + body + struct.pack('<H', binascii.crc_hqx(body, 0xFFFF)))
+
+    def _handle_frame(self, frame):
+        """handle_frame(): evaluate a complete binary frame"""
+
+        length = frame[1]
+        if length == 0 or binascii.crc_hqx(frame[1:length + 2], 0xFFFF) != struct.unpack_from('<H', frame, length + 2)[0]:
+            self._send_frame(frame[2] if length > 0 else 0, FRAME_CRC_ERR)
+            return
+
+        cmd = frame[2]
+        payload = frame[3:length + 2]
+
+        if cmd == ord('i') and not payload:
+            self._baudrate_switch = None
+            self._send_frame(cmd, FRAME_OK, b'mph Meter')
+        elif cmd == ord('r') and not payload:
+            major, minor = self._version[:2]
+            self._send_frame(cmd, FRAME_OK, struct.pack('<LLHHBB',
+                self.stored_vars[0], self.stored_vars[1], self.stored_vars[2] & 0xFFFF, int(self._read_vbat() * 1000), major, minor
+                ))
+        elif cmd in b'mdt' and len(payload) == 4:
+            index = b'mdt'.index(cmd)
+            value, = struct.unpack('<L', payload)
+            if value > LIMITS[index]:
+                self._send_frame(cmd, FRAME_ERR)
+            else:
+                self.stored_vars[index] = value
+                self._eeprom_put()
+                self._send_frame(cmd, FRAME_OK)
+        elif cmd == ord('a') and len(payload) == 13:
+            mask, *values = struct.unpack('<BLLL', payload)
+            new_vars = list(self.stored_vars)
+            valid = True
+            for index in range(3):
+                if mask & (1 << index):
+                    if values[index] > LIMITS[index]:
+                        valid = False
+                    else:
+                        new_vars[index] = values[index]
+            if valid:
+                self.stored_vars = new_vars
+                self._eeprom_put()
+                self._send_frame(cmd, FRAME_OK)
+            else:
+                self._send_frame(cmd, FRAME_ERR)
+        else:
+            self._send_frame(cmd, FRAME_ERR)
+
+    def _generate_pulses(self):
+        """Run on_meas() for every synthetic pulse that was due since the last loop cycle"""
+
+        if not self.pulse_hz:
+            self._next_pulse = None
+            return
+
+        now = time.monotonic()
+        if self._next_pulse is None:
+            self._next_pulse = now
+
+        period = 1.0 / self.pulse_hz
+        while self._next_pulse <= now:
+            self._on_meas(self._next_pulse)
+            self._next_pulse += max(period * 0.01, random.gauss(period, period * self.jitter))
+
+    def _on_meas(self, timestamp):
+        """on_meas() interrupt handler for a pulse at timestamp (time.monotonic)"""
+
+        now = int((timestamp - self._boot) * 1e3) & ULONG_MAX
+        now_us = int((timestamp - self._boot) * 1e6) & ULONG_MAX
+
+        if now > (self._last_pulse + self.stored_vars[1]) & ULONG_MAX:
+            self._last_pulse = now
+
+            if self._streaming:
+                #One slot stays free to tell a full ring buffer from an empty one
+                if len(self._stream_buf) < STREAM_BUF_SIZE - 1:
+                    self._stream_buf.append((self._stream_seq, now_us))
+                self._stream_seq = (self._stream_seq + 1) & 0xFF
+
+    def _stream_flush(self):
+        """stream_flush()"""
+
+        records = b''.join(struct.pack('<BBL', STREAM_HEADER, seq, ts) for seq, ts in self._stream_buf)
+        self._stream_buf = []
+        if records:
+            self._write(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate mph Meters on pseudo terminals.')
+    parser.add_argument('-n', '--count', type=int, default=1, help='Number of simulated mph Meters.')
+    parser.add_argument('--eeprom-dir', help='Directory for persisting the EEPROM contents of every mph Meter.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Additional delay before every reply in seconds.')
+    parser.add_argument('--baudrate', type=int, help='Throttle replies to the given baudrate.')
+    parser.add_argument('--loop-period', type=float, default=0.05, help='Time between two loop() cycles in seconds.')
+    parser.add_argument('--pulse-hz', type=float, default=0.0, help='Rate of synthetic pulses.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Standard deviation of the pulse period (fraction).')
+    parser.add_argument('--version', default=VERSION, help='Simulated Firmware version.')
+    args = parser.parse_args()
+
+    meters = []
+    for index in range(args.count):
+        eeprom = None if args.eeprom_dir is None else os.path.join(args.eeprom_dir, 'eeprom{}.bin'.format(index))
+        meters.append(SimulatedMeter(eeprom, args.latency, args.baudrate, args.loop_period, args.pulse_hz, args.jitter, version=args.version).start())
+        print(meters[-1].port, flush=True)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for meter in meters:
+            meter.stop()
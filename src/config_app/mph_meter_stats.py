@@ -0,0 +1,163 @@
+"""
+Communication statistics of a mph Meter connection.
+
+MphMeter records every command it sends (see MphMeter.stats): number of
+commands per outcome, reply latency histogram, timeouts, rejected or
+invalid replies and bytes sent and received. Growing latencies, timeouts
+or reply errors show a degrading cable, USB hub or mph Meter before it fails
+completely.
+
+Statistics can be queried as dict, exported as JSON or in the text format
+of Prometheus (e.g. for the textfile collector of the node exporter).
+
+Required modules:
+-None
+"""
+
+import os
+import threading
+
+#Upper bounds of the latency histogram buckets in seconds (Prometheus defaults)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#Outcome of a command
+OK = 'ok'
+#mph Meter answered ERR
+ERROR = 'error'
+#No (complete) reply within the timeout
+TIMEOUT = 'timeout'
+
+OUTCOMES = (OK, ERROR, TIMEOUT)
+
+
+class MeterStats():
+    """Counters and latency histograms per command. Thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Set all statistics to zero"""
+
+        with self._lock:
+            #Command: {outcome: count}
+            self._outcomes = {}
+            #Command: number of ReplyErrors (invalid, rejected or corrupted replies)
+            self._reply_errors = {}
+            #Command: [count per bucket (last one is +Inf), sum of latencies]
+            self._latency = {}
+            self._bytes_sent = {}
+            self._bytes_received = {}
+
+    def record(self, command, latency_s, sent, received, outcome=OK):
+        """Record a command (first letter of the command) that was sent with sent bytes and answered with received bytes after latency_s seconds"""
+
+        with self._lock:
+            outcomes = self._outcomes.setdefault(command, dict.fromkeys(OUTCOMES, 0))
+            outcomes[outcome] += 1
+
+            histogram = self._latency.setdefault(command, [[0] * (len(LATENCY_BUCKETS) + 1), 0.0])
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if latency_s <= bound:
+                    break
+            else:
+                index = len(LATENCY_BUCKETS)
+            histogram[0][index] += 1
+            histogram[1] += latency_s
+
+            self._bytes_sent[command] = self._bytes_sent.get(command, 0) + sent
+            self._bytes_received[command] = self._bytes_received.get(command, 0) + received
+
+    def add_received(self, command, received):
+        """Count bytes received without a command of their own (e.g. pulse stream records)"""
+
+        with self._lock:
+            self._bytes_received[command] = self._bytes_received.get(command, 0) + received
+
+    def reply_error(self, command):
+        """Count a ReplyError raised for command"""
+
+        with self._lock:
+            self._reply_errors[command] = self._reply_errors.get(command, 0) + 1
+
+    def snapshot(self):
+        """Statistics as dict of command and dict with the keys
+        count, ok, error, timeout, reply_errors, bytes_sent, bytes_received,
+        latency_sum_s, latency_mean_s and latency_buckets (list of [upper bound or None for +Inf, count], not cumulative)"""
+
+        with self._lock:
+            commands = set(self._outcomes) | set(self._reply_errors) | set(self._bytes_received)
+            result = {}
+            for command in sorted(commands):
+                outcomes = self._outcomes.get(command, dict.fromkeys(OUTCOMES, 0))
+                buckets, total = self._latency.get(command, [[0] * (len(LATENCY_BUCKETS) + 1), 0.0])
+                count = sum(outcomes.values())
+                result[command] = {
+                    'count': count,
+                    'ok': outcomes[OK],
+                    'error': outcomes[ERROR],
+                    'timeout': outcomes[TIMEOUT],
+                    'reply_errors': self._reply_errors.get(command, 0),
+                    'bytes_sent': self._bytes_sent.get(command, 0),
+                    'bytes_received': self._bytes_received.get(command, 0),
+                    'latency_sum_s': total,
+                    'latency_mean_s': total / count if count else None,
+                    'latency_buckets': [[bound, n] for bound, n in zip(LATENCY_BUCKETS + (None,), buckets)],
+                    }
+            return result
+
+    def to_json(self, **kwargs):
+        """snapshot as JSON string. kwargs are passed to json.dumps"""
+
+        import json
+
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, labels=None):
+        """snapshot in the Prometheus text exposition format. labels (dict) are added to every sample, e.g. {'port': 'COM3'}"""
+
+        def sample(name, value, **extra):
+            merged = dict(labels or {}, **extra)
+            text = ','.join('{}="{}"'.format(key, str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, val in merged.items())
+            return '{}{{{}}} {}'.format(name, text, value) if text else '{} {}'.format(name, value)
+
+        snapshot = self.snapshot()
+        lines = []
+
+        lines.append('# HELP mph_meter_commands_total Commands sent to the mph Meter by outcome.')
+        lines.append('# TYPE mph_meter_commands_total counter')
+        for command, stats in snapshot.items():
+            for outcome in OUTCOMES:
+                lines.append(sample('mph_meter_commands_total', stats[outcome], command=command, outcome=outcome))
+
+        lines.append('# HELP mph_meter_reply_errors_total Invalid, rejected or corrupted replies of the mph Meter.')
+        lines.append('# TYPE mph_meter_reply_errors_total counter')
+        for command, stats in snapshot.items():
+            lines.append(sample('mph_meter_reply_errors_total', stats['reply_errors'], command=command))
+
+        lines.append('# HELP mph_meter_command_duration_seconds Time from sending a command until its reply was received.')
+        lines.append('# TYPE mph_meter_command_duration_seconds histogram')
+        for command, stats in snapshot.items():
+            cumulative = 0
+            for bound, count in stats['latency_buckets']:
+                cumulative += count
+                lines.append(sample('mph_meter_command_duration_seconds_bucket', cumulative, command=command, le='+Inf' if bound is None else repr(bound)))
+            lines.append(sample('mph_meter_command_duration_seconds_sum', repr(stats['latency_sum_s']), command=command))
+            lines.append(sample('mph_meter_command_duration_seconds_count', stats['count'], command=command))
+
+        for name, key, text in (('sent', 'bytes_sent', 'Bytes sent to'), ('received', 'bytes_received', 'Bytes received from')):
+            lines.append('# HELP mph_meter_bytes_{}_total {} the mph Meter.'.format(name, text))
+            lines.append('# TYPE mph_meter_bytes_{}_total counter'.format(name))
+            for command, stats in snapshot.items():
+                lines.append(sample('mph_meter_bytes_{}_total'.format(name), stats[key], command=command))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, labels=None):
+        """Write to_prometheus to file at path. The file is replaced atomically, so a collector never reads a partial file"""
+
+        temp = path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus(labels))
+        os.replace(temp, path)
@@ -0,0 +1,356 @@
+"""
+Built-in STK500v1 programmer for the optiboot bootloader of the mph Meter's Arduino.
+
+Replaces the avrdude subprocess: the Intel HEX Firmware image is parsed in
+Python and written page by page over the serial port. Optionally every page
+is read back and verified. Works on every platform supported by pyserial.
+
+Incremental flashing only writes the pages that differ from the current
+flash contents, either read back from the Arduino or taken from a cached
+copy of the image last flashed to the device.
+
+Required modules:
+-pyserial (serial)
+"""
+
+import errno
+import hashlib
+import json
+import os
+import time
+
+#Using pyserial for serial port communication
+import serial
+
+from mph_meter import (
+    FW_HEX,
+    ReplyError,
+    LostConnectionError,
+    )
+
+#STK500v1 protocol constants
+STK_OK = 0x10
+STK_INSYNC = 0x14
+CRC_EOP = 0x20
+STK_GET_SYNC = 0x30
+STK_ENTER_PROGMODE = 0x50
+STK_LEAVE_PROGMODE = 0x51
+STK_LOAD_ADDRESS = 0x55
+STK_PROG_PAGE = 0x64
+STK_READ_PAGE = 0x74
+STK_READ_SIGN = 0x75
+
+#ATmega328P
+SIGNATURE = b'\x1e\x95\x0f'
+PAGE_SIZE = 128
+#Application section, the upper 512 bytes are occupied by optiboot
+FLASH_SIZE = 32768 - 512
+
+#Directory holding the last image flashed to each device (see flash with incremental='cache')
+FLASH_CACHE = os.path.join('.', 'flash_cache')
+
+#File mapping Firmware image digests to the version string reported by mph Meters running that image ('images')
+#and devices to the digest of the image last flashed to them ('devices'), see mph_meter_flash.py
+FW_CACHE = os.path.join('.', 'fw_cache.json')
+
+
+def read_hex(path=FW_HEX):
+    """Parse Intel HEX file and return its contents as flash image starting at address 0 (gaps are filled with 0xFF)"""
+
+    image = bytearray()
+    base = 0
+
+    with open(path, 'r', encoding='ascii') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if line == '':
+                continue
+            if not line.startswith(':'):
+                raise ValueError('Line {}: Record does not start with ":"'.format(lineno))
+
+            try:
+                record = bytes.fromhex(line[1:])
+            except ValueError:
+                raise ValueError('Line {}: Invalid hex digits'.format(lineno))
+
+            if len(record) < 5 or len(record) != record[0] + 5:
+                raise ValueError('Line {}: Invalid record length'.format(lineno))
+            if sum(record) & 0xFF != 0:
+                raise ValueError('Line {}: Checksum mismatch'.format(lineno))
+
+            length, rectype, data = record[0], record[3], record[4:-1]
+            address = base + (record[1] << 8 | record[2])
+
+            if rectype == 0x00:
+                #Data record
+                if len(image) < address + length:
+                    image.extend(b'\xff' * (address + length - len(image)))
+                image[address:address + length] = data
+            elif rectype == 0x01:
+                #End of file record
+                break
+            elif rectype == 0x02:
+                #Extended segment address record
+                base = (data[0] << 8 | data[1]) << 4
+            elif rectype == 0x04:
+                #Extended linear address record
+                base = (data[0] << 8 | data[1]) << 16
+            #Start address records (0x03, 0x05) are irrelevant for AVRs
+
+    return bytes(image)
+
+
+def pages(image, page_size=PAGE_SIZE):
+    """Split flash image into (address, data) tuples of full pages. The last page is padded with 0xFF"""
+
+    for address in range(0, len(image), page_size):
+        page = image[address:address + page_size]
+        yield address, page + b'\xff' * (page_size - len(page))
+
+
+class Stk500Programmer():
+    """STK500v1 programmer talking to the optiboot bootloader over a serial port"""
+
+    def __init__(self, port, baudrate=115200, timeout=0.5):
+        self._serial = serial.Serial(baudrate=baudrate, timeout=timeout)
+        self._serial.port = port
+
+    def _command(self, data, reply_len=0):
+        """Send command terminated by CRC_EOP and return the reply between STK_INSYNC and STK_OK"""
+
+        try:
+            self._serial.write(bytes(data) + bytes([CRC_EOP]))
+            self._serial.flush()
+            reply = self._serial.read(reply_len + 2)
+        except serial.SerialException:
+            self._serial.close()
+            raise LostConnectionError
+
+        if len(reply) != reply_len + 2:
+            raise ReplyError('No reply received from bootloader', reply)
+        if reply[0] != STK_INSYNC or reply[-1] != STK_OK:
+            raise ReplyError('Incorrect reply received from bootloader: {}'.format(reply.hex()), reply)
+
+        return reply[1:-1]
+
+    def _reset(self):
+        """Reset the Arduino over DTR/RTS to start the bootloader"""
+
+        try:
+            self._serial.dtr = False
+            self._serial.rts = False
+            time.sleep(0.25)
+            self._serial.dtr = True
+            self._serial.rts = True
+            time.sleep(0.05)
+        except OSError as e:
+            #Ports without modem control lines (e.g. pseudo terminals) can not reset the Arduino, same as in pyserial
+            if e.errno not in (errno.EINVAL, errno.ENOTTY):
+                raise
+        self._serial.reset_input_buffer()
+
+    def open(self, attempts=10):
+        """Open serial port, reset the Arduino and synchronize with the bootloader"""
+
+        self._serial.open()
+        self._reset()
+
+        for attempt in range(attempts):
+            try:
+                self._command([STK_GET_SYNC])
+            except ReplyError:
+                self._serial.reset_input_buffer()
+            else:
+                break
+        else:
+            self._serial.close()
+            raise ReplyError('Bootloader did not respond')
+
+        signature = self._command([STK_READ_SIGN], 3)
+        if signature != SIGNATURE:
+            self.close()
+            raise ReplyError('Unexpected device signature: {}'.format(signature.hex()), signature)
+
+        self._command([STK_ENTER_PROGMODE])
+
+    def close(self):
+        """Leave programming mode, which starts the Firmware, and close serial port"""
+
+        if self._serial.is_open:
+            try:
+                self._command([STK_LEAVE_PROGMODE])
+            except (ReplyError, LostConnectionError):
+                pass
+            self._serial.close()
+
+    def _load_address(self, address):
+        """Set flash address for next page operation (byte address, the bootloader expects words)"""
+
+        word = address // 2
+        self._command([STK_LOAD_ADDRESS, word & 0xFF, word >> 8])
+
+    def write_page(self, address, data):
+        """Write one page of flash"""
+
+        self._load_address(address)
+        self._command(bytes([STK_PROG_PAGE, len(data) >> 8, len(data) & 0xFF, ord('F')]) + data)
+
+    def read_page(self, address, length=PAGE_SIZE):
+        """Read one page of flash"""
+
+        self._load_address(address)
+        return self._command([STK_READ_PAGE, length >> 8, length & 0xFF, ord('F')], length)
+
+
+def device_ids(ports):
+    """Identify the Arduinos at ports by their USB serial numbers. Returns dict of port and serial number (port name if there is none)"""
+
+    #Only needed for incremental flashing, slow to import
+    import serial.tools.list_ports as serialports
+
+    serial_numbers = {info.device: info.serial_number for info in serialports.comports() if info.serial_number}
+    return {port: serial_numbers.get(port, port) for port in ports}
+
+
+def device_id(port):
+    """Identify the Arduino at port by its USB serial number. Falls back to the port name if there is none"""
+
+    return device_ids([port])[port]
+
+
+def _cache_path(device):
+    """File of the flash cache holding the last image written to device"""
+
+    return os.path.join(FLASH_CACHE, '{}.bin'.format(''.join(c if c.isalnum() else '_' for c in device)))
+
+
+def load_cached_image(device):
+    """Image last flashed to device or None if unknown"""
+
+    try:
+        with open(_cache_path(device), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def store_cached_image(device, image):
+    """Remember image as flash contents of device. None removes the entry"""
+
+    path = _cache_path(device)
+    if image is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    os.makedirs(FLASH_CACHE, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(image)
+
+
+def hex_digest(path=FW_HEX):
+    """SHA-256 digest of a Firmware image"""
+
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_cache(path=FW_CACHE):
+    """Load cache (dict with 'images': digest -> version and 'devices': device -> digest).
+    A missing or broken cache file results in an empty cache"""
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    if not isinstance(cache, dict) or not isinstance(cache.get('images'), dict) or not isinstance(cache.get('devices'), dict):
+        #Older caches only mapped digests to versions, which does not tell which device runs which image
+        return {'images': {}, 'devices': {}}
+    return cache
+
+
+def save_cache(cache, path=FW_CACHE):
+    """Store cache (see load_cache)"""
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=4, sort_keys=True)
+
+
+def record_device(device, digest, path=FW_CACHE):
+    """Remember in the Firmware cache that the image with digest was flashed to device. None: contents unknown (flashing started or failed)"""
+
+    cache = load_cache(path)
+    if digest is None:
+        cache['devices'].pop(device, None)
+    else:
+        cache['devices'][device] = digest
+    save_cache(cache, path)
+
+
+def flash(port, path=FW_HEX, verify=True, progress=None, incremental=None):
+    """Programm Firmware image at path into the mph Meter at port.
+    progress(phase, page, page_count) is called after every page, phase is 'read', 'write' or 'verify'.
+    incremental selects which pages are written:
+        None: all pages of the image
+        'readback': only pages whose current flash contents differ (read back from the Arduino first)
+        'cache': only pages that differ from the image last flashed to this device (see FLASH_CACHE).
+                 Falls back to 'readback' for unknown devices. Only safe if no other programmer than this module flashes the device
+                 (avrdude drops the cached image, see forget_device).
+    The image is remembered as flash contents of the device after every successful flash, whatever incremental is.
+    Returns the number of pages written.
+    Raises ReplyError if the bootloader misbehaves or verification fails."""
+
+    if incremental not in (None, 'readback', 'cache'):
+        raise ValueError('Unknown incremental mode: {}'.format(repr(incremental)))
+
+    image = read_hex(path)
+    if len(image) > FLASH_SIZE:
+        raise ValueError('Firmware image does not fit into flash ({} bytes)'.format(len(image)))
+
+    image_pages = list(pages(image))
+
+    device = device_id(port)
+    previous = None
+    if incremental == 'cache':
+        previous = load_cached_image(device)
+        if previous is None:
+            incremental = 'readback'
+    #An aborted flash leaves the device in an unknown state
+    store_cached_image(device, None)
+
+    programmer = Stk500Programmer(port)
+    programmer.open()
+
+    try:
+        if incremental == 'readback':
+            previous = bytearray()
+            for index, (address, data) in enumerate(image_pages, 1):
+                previous += programmer.read_page(address, len(data))
+                if progress is not None:
+                    progress('read', index, len(image_pages))
+
+        if previous is not None:
+            changed = [(address, data) for address, data in image_pages if previous[address:address + len(data)] != data]
+        else:
+            changed = image_pages
+
+        for index, (address, data) in enumerate(changed, 1):
+            programmer.write_page(address, data)
+            if progress is not None:
+                progress('write', index, len(changed))
+
+        #Unchanged pages were either just read back or are known from the cache
+        if verify:
+            for index, (address, data) in enumerate(changed, 1):
+                if programmer.read_page(address, len(data)) != data:
+                    raise ReplyError('Verification failed at address 0x{:04x}'.format(address), address)
+                if progress is not None:
+                    progress('verify', index, len(changed))
+    finally:
+        programmer.close()
+
+    store_cached_image(device, b''.join(data for address, data in image_pages))
+
+    return len(changed)
@@ -0,0 +1,161 @@
+"""
+Background watcher keeping an inventory of serial ports and mph Meters.
+
+Instead of enumerating all serial ports and probing them every time a list
+of mph Meters is needed, PortWatcher polls for USB serial devices being
+plugged in or removed and only probes the ports that were added (see
+mph_meter_discovery). On Linux, changes are detected by listing
+/sys/class/tty, which is much cheaper than a full enumeration. Elsewhere
+the port list of pyserial is compared. The inventory is kept in memory and
+can be read at any time without touching the serial ports.
+
+Required modules:
+-pyserial (serial)
+-pyserial-asyncio (serial_asyncio)
+"""
+
+import os
+import sys
+import threading
+
+from mph_meter_discovery import candidate_ports, discover
+
+SYSFS_TTY = '/sys/class/tty'
+
+
+def _sysfs_signature():
+    """Names and device paths of all ttys backed by a device (no virtual consoles or pseudo terminals)"""
+
+    signature = {}
+    for name in os.listdir(SYSFS_TTY):
+        device = os.path.join(SYSFS_TTY, name, 'device')
+        if os.path.exists(device):
+            signature[name] = os.path.realpath(device)
+    return signature
+
+
+class PortWatcher():
+    """Inventory of serial ports and identified mph Meters, kept up to date by a background thread"""
+
+    def __init__(self, interval=1.0, timeout=0.3, on_change=None):
+        """interval: time between two polls in seconds
+        timeout: reply timeout when probing ports
+        on_change(added, removed): called from the watcher thread after ports were added or removed (lists of port names)"""
+
+        self.interval = interval
+        self.timeout = timeout
+        self.on_change = on_change
+
+        self._lock = threading.Lock()
+        #Port name: USB serial number (or None)
+        self._ports = {}
+        #Port name: MeterInfo
+        self._meters = {}
+        self._signature = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching in a background thread"""
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop background thread"""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        while True:
+            self.scan()
+            if self._stop.wait(self.interval):
+                break
+
+    @staticmethod
+    def _poll():
+        """Cheap snapshot of the serial devices present, only used to detect changes"""
+
+        if sys.platform.startswith('linux') and os.path.isdir(SYSFS_TTY):
+            return _sysfs_signature()
+        return candidate_ports()
+
+    def scan(self):
+        """Check once for ports that were added or removed and probe the added ones. Returns lists of added and removed ports"""
+
+        signature = self._poll()
+        if signature == self._signature:
+            return [], []
+        self._signature = signature
+
+        ports = candidate_ports()
+        with self._lock:
+            #A different device at a known port name counts as added
+            added = {port: serial_number for port, serial_number in ports.items() if port not in self._ports or self._ports[port] != serial_number}
+            removed = [port for port in self._ports if port not in ports]
+            self._ports = ports
+            for port in removed:
+                self._meters.pop(port, None)
+
+        if added:
+            self._update(added, discover(added, timeout=self.timeout))
+
+        if (added or removed) and self.on_change is not None:
+            self.on_change(list(added), removed)
+        return list(added), removed
+
+    def probe(self, ports=None):
+        """Identify the mph Meters at the given known ports (default: all) again, e.g. after flashing. Returns list of MeterInfo found"""
+
+        with self._lock:
+            ports = {port: serial_number for port, serial_number in self._ports.items() if ports is None or port in ports}
+
+        meters = discover(ports, timeout=self.timeout)
+        self._update(ports, meters)
+        return meters
+
+    def _update(self, probed, meters):
+        """Replace inventory entries of the probed ports with the mph Meters found"""
+
+        with self._lock:
+            for port in probed:
+                self._meters.pop(port, None)
+            for meter in meters:
+                #Port may have been removed while probing
+                if meter.port in self._ports:
+                    self._meters[meter.port] = meter
+
+    def find(self, serial_number):
+        """MeterInfo of the mph Meter with the given USB serial number or None if unknown"""
+
+        with self._lock:
+            for meter in self._meters.values():
+                if meter.serial_number == serial_number:
+                    return meter
+        return None
+
+    @property
+    def ports(self):
+        """All serial ports present (dict of port name and USB serial number)"""
+
+        with self._lock:
+            return dict(self._ports)
+
+    @property
+    def meters(self):
+        """Identified mph Meters (dict of port name and MeterInfo)"""
+
+        with self._lock:
+            return dict(self._meters)
@@ -1,44 +1,32 @@
 from cx_Freeze import setup, Executable
 
 import mph_meter_configurator as source
+import mph_meter_buildprofile as buildprofile
+
+# Frozen modules are taken from an import trace of the application instead of
+# a hand-written list: every standard library package that is not imported is
+# excluded (see mph_meter_buildprofile.py). The profile is written to
+# build/build_profile.json for comparison with previous builds.
+profile = buildprofile.profile(buildprofile.trace(), buildprofile.trace([], []))
+buildprofile.save_profile(profile)
 
-# Dependencies are automatically detected, but it might need
-# fine tuning.
 buildOptions = dict(
-    packages = [
-        "tkinter",
-        "io",
-        "time",
-        "os",
-        "itertools",
-        "serial",
-        "re",
-        "threading",
-        ],
-    excludes = [
-        "asyncio",
-        #"collections",
-        "concurrent",
-        #"ctypes",
-        "email",
-        #"encodings",
-        "html",
-        "http",
-        #"importlib",
-        "logging",
-        "multiprocessing",
-        "pydoc_data",
-        "unittest",
-        "urllib",
-        "xml",
-        "xmlrpc",
-        ])
+    packages = profile['packages'],
+    excludes = profile['excludes'],
+    # Precompiled bytecode of all modules in a single zip archive,
+    # which is faster to load than thousands of single files
+    zip_include_packages = ["*"],
+    zip_exclude_packages = [],
+    optimize = 1,
+    )
 
 import sys
 base = 'Win32GUI' if sys.platform=='win32' else None
 
 executables = [
-    Executable(source.__file__, base=base)
+    Executable(source.__file__, base=base),
+    # Headless command line interface
+    Executable('mph_meter_cli.py', base=None),
 ]
 
 setup(name=source.__title__,
@@ -2,9 +2,12 @@
 #include <LiquidCrystal.h>
 #include <stdlib.h>
 #include <EEPROM.h>
+#include <util/crc16.h>
 
 //version
-#define VERSION "0.2"
+#define VERSION "0.6"
+#define VERSION_MAJOR 0
+#define VERSION_MINOR 6
 #define AUTHOR "Michael Fiederer"
 
 /*
@@ -18,6 +21,18 @@
  *    -fixed slow response at serial port by reducing delay in main function from 500 to 50ms
  *    -increased possible SW debounce time from 999ms to 999.999ms
  *    -first mph value calculation now happen with the second pulse, not directly with the first pulse to ommit incorect values
+ *  v0.3:
+ *    -added pulse streaming mode (s1/s0 commands): every accepted pulse is sent as 6 byte binary record
+ *      (0xA5, 8 bit sequence number, 32 bit little endian timestamp in us)
+ *  v0.4:
+ *    -added a command for setting several values at once with a single EEPROM write
+ *      (a<muem_per_pulse>;<debounce_time_ms>;<bat_critical_mv>, empty fields are left unchanged)
+ *    -increased serial rx buffer from 12 to 32 bytes to fit the a command
+ *  v0.5:
+ *    -added b command for switching to a higher baudrate (b<baudrate>). The new baudrate has to be confirmed by an
+ *      i command within 1s, otherwise the default baudrate of 9600 is restored
+ *  v0.6:
+ *    -added binary protocol alongside the text protocol: 0x7E, length, command, payload, CRC16 (see handle_frame)
  * 
  */
 
@@ -64,9 +79,36 @@ int counter = 0;
 volatile unsigned long last_pulse = 0UL;
 volatile unsigned long last_pulse_interval = 0UL;
 
+//Pulse streaming. on_meas() pushes into the ring buffer, loop() sends the records
+#define stream_header 0xA5
+#define stream_buf_size 32
+volatile bool streaming = false;
+volatile unsigned long stream_buf_ts[stream_buf_size];
+volatile byte stream_buf_seq[stream_buf_size];
+volatile byte stream_head = 0;
+volatile byte stream_tail = 0;
+//Incremented for every accepted pulse, also if it was dropped because the ring buffer was full
+volatile byte stream_seq = 0;
+
+//Baudrate negotiation
+#define default_baudrate 9600UL
+#define baudrate_confirm_ms 1000UL
+const unsigned long baudrates[] = {9600UL, 19200UL, 38400UL, 57600UL, 115200UL, 250000UL, 500000UL, 1000000UL};
+const int baudrate_count = 8;
+bool baudrate_pending = false;
+unsigned long baudrate_switch_time = 0UL;
+
+//Binary frames: frame_start, length of command + payload, command, payload, CRC-16/CCITT (init 0xFFFF, little endian) over length, command and payload
+#define frame_start 0x7E
+#define frame_timeout_ms 500UL
+#define frame_ok 0
+#define frame_err 1
+#define frame_crc_err 2
+unsigned long frame_time = 0UL;
+
 //Serial rx bufer definiation
-const size_t serial_rx_size = 12;
-char serial_rx_buf[12];
+const size_t serial_rx_size = 32;
+char serial_rx_buf[32];
 size_t serial_rx_pos = 0;
 
 //LCD
@@ -74,7 +116,7 @@ LiquidCrystal lcd(lcd_rs, lcd_en, lcd_d4, lcd_d5, lcd_d6, lcd_d7);
 
 void setup() {
   //serial port for communication with Configuration tool
-  Serial.begin(9600);
+  Serial.begin(default_baudrate);
 
   //Clear rx buffer
   memset(serial_rx_buf, 0, serial_rx_size);
@@ -113,6 +155,23 @@ void loop() {
   else {
     counter++;
   } 
+
+  if (streaming) {
+    stream_flush();
+  }
+
+  //Discard incomplete binary frame
+  if ((byte)serial_rx_buf[0] == frame_start && millis() - frame_time > frame_timeout_ms) {
+    serial_rx_pos = 0;
+    memset(serial_rx_buf, 0, serial_rx_size);
+  }
+
+  //Restore default baudrate if the host did not confirm the new one
+  if (baudrate_pending && millis() - baudrate_switch_time > baudrate_confirm_ms) {
+    Serial.end();
+    Serial.begin(default_baudrate);
+    baudrate_pending = false;
+  }
   delay(50);
 
 }
@@ -122,6 +181,26 @@ void serialEvent() {
     while(Serial.available()){
         serial_rx_buf[serial_rx_pos] = (char)Serial.read();
 
+        //Binary frame. frame_start never starts a text command
+        if ((byte)serial_rx_buf[0] == frame_start){
+            if (serial_rx_pos == 0){
+              frame_time = millis();
+            }
+            serial_rx_pos++;
+            if (serial_rx_pos >= 2 && (size_t)(byte)serial_rx_buf[1] + 4 > serial_rx_size){
+              //Frame would not fit into buffer
+              serial_rx_pos = 0;
+              memset(serial_rx_buf, 0, serial_rx_size);
+              send_frame(0, frame_err, NULL, 0);
+            }
+            else if (serial_rx_pos >= 2 && serial_rx_pos == (size_t)(byte)serial_rx_buf[1] + 4){
+              handle_frame();
+              serial_rx_pos = 0;
+              memset(serial_rx_buf, 0, serial_rx_size);
+            }
+            continue;
+        }
+
         if (serial_rx_buf[serial_rx_pos] == '\n'){
             if (serial_rx_buf[0] == 'r'){
               //read command
@@ -166,8 +245,90 @@ void serialEvent() {
                   Serial.write("OK\n");
                 }
             }
+            else if (serial_rx_buf[0] == 'a'){
+              //change several values at once, update EEPROM only once
+              //All values are checked before any of them is changed
+                eepdata new_vars = stored_vars;
+                unsigned long *fields[3] = {&new_vars.muem_per_pulse, &new_vars.debounce_time_ms, &new_vars.bat_critical_mv};
+                const unsigned long limits[3] = {999999999UL, 999999UL, 15000UL};
+                char *pos = &serial_rx_buf[1];
+                bool valid = true;
+
+                for (int i=0; i<3; i++){
+                  //empty fields are left unchanged
+                  if (*pos != ';' && *pos != '\n'){
+                    char *end;
+                    unsigned long value = strtoul(pos, &end, 10);
+                    if (end == pos || value > limits[i]){
+                      valid = false;
+                    }
+                    else {
+                      *fields[i] = value;
+                    }
+                    pos = end;
+                  }
+                  if (i < 2){
+                    if (*pos == ';'){
+                      pos++;
+                    }
+                    else {
+                      valid = false;
+                    }
+                  }
+                }
+
+                if (valid && *pos == '\n'){
+                  stored_vars = new_vars;
+                  EEPROM.put(0, stored_vars);
+                  Serial.write("OK\n");
+                }
+                else {
+                  Serial.write("ERR\n");
+                }
+            }
+            else if (serial_rx_buf[0] == 's'){
+              //start (s1) or stop (s0) pulse streaming
+                if (serial_rx_buf[1] == '1'){
+                  noInterrupts();
+                  stream_head = 0;
+                  stream_tail = 0;
+                  streaming = true;
+                  interrupts();
+                  Serial.write("OK\n");
+                }
+                else if (serial_rx_buf[1] == '0'){
+                  streaming = false;
+                  stream_flush();
+                  Serial.write("OK\n");
+                }
+                else {
+                  Serial.write("ERR\n");
+                }
+            }
+            else if (serial_rx_buf[0] == 'b'){
+              //switch baudrate after replying with the current one
+                unsigned long value = strtoul(&serial_rx_buf[1], NULL, 10);
+                bool supported = false;
+                for (int i=0; i<baudrate_count; i++){
+                  if (baudrates[i] == value){
+                    supported = true;
+                  }
+                }
+                if (!supported){
+                  Serial.write("ERR\n");
+                }
+                else {
+                  Serial.write("OK\n");
+                  Serial.flush();
+                  Serial.end();
+                  Serial.begin(value);
+                  baudrate_pending = value != default_baudrate;
+                  baudrate_switch_time = millis();
+                }
+            }
             else if (serial_rx_buf[0] == 'i'){
-              //identify command. Write "mph Meter\n" to UART
+              //identify command. Write "mph Meter\n" to UART. Also confirms a new baudrate
+                baudrate_pending = false;
                 Serial.write("mph Meter\n");
             }
             else {
@@ -193,6 +354,113 @@ void serialEvent() {
     }
 }
 
+void send_frame(byte cmd, byte status, const void *data, byte size) {
+  /*
+  Send binary reply frame. The payload consists of the status followed by data
+  */
+  byte header[4] = {frame_start, (byte)(size + 2), cmd, status};
+  uint16_t crc = 0xFFFF;
+
+  for (byte i=1; i<4; i++){
+    crc = _crc_xmodem_update(crc, header[i]);
+  }
+  for (byte i=0; i<size; i++){
+    crc = _crc_xmodem_update(crc, ((const byte *)data)[i]);
+  }
+
+  Serial.write(header, 4);
+  if (size > 0){
+    Serial.write((const byte *)data, size);
+  }
+  Serial.write((byte)(crc & 0xFF));
+  Serial.write((byte)(crc >> 8));
+}
+
+void handle_frame() {
+  /*
+  Evaluate binary frame in serial_rx_buf. Commands are the same as in the text protocol, values are little endian:
+    i: reply "mph Meter"
+    r: reply muem_per_pulse (4), debounce_time_ms (4), bat_critical_mv (2), vbat_mv (2), version major (1), minor (1)
+    m/d/t: value (4)
+    a: bit mask of values to change (1), muem_per_pulse (4), debounce_time_ms (4), bat_critical_mv (4)
+  */
+  byte len = (byte)serial_rx_buf[1];
+  byte *data = (byte *)&serial_rx_buf[2];
+  uint16_t crc = 0xFFFF;
+
+  for (byte i=0; i<len+1; i++){
+    crc = _crc_xmodem_update(crc, (byte)serial_rx_buf[1+i]);
+  }
+  if (len == 0 || crc != (uint16_t)(data[len] | (data[len+1] << 8))){
+    send_frame(len > 0 ? data[0] : 0, frame_crc_err, NULL, 0);
+    return;
+  }
+
+  byte cmd = data[0];
+  byte *payload = &data[1];
+  byte size = len - 1;
+  const unsigned long limits[3] = {999999999UL, 999999UL, 15000UL};
+
+  if (cmd == 'i' && size == 0){
+    baudrate_pending = false;
+    send_frame(cmd, frame_ok, "mph Meter", 9);
+  }
+  else if (cmd == 'r' && size == 0){
+    byte reply[14];
+    unsigned int vcrit = stored_vars.bat_critical_mv;
+    unsigned int vbat = (unsigned int)(read_vbat()*1000);
+    memcpy(&reply[0], &stored_vars.muem_per_pulse, 4);
+    memcpy(&reply[4], &stored_vars.debounce_time_ms, 4);
+    memcpy(&reply[8], &vcrit, 2);
+    memcpy(&reply[10], &vbat, 2);
+    reply[12] = VERSION_MAJOR;
+    reply[13] = VERSION_MINOR;
+    send_frame(cmd, frame_ok, reply, 14);
+  }
+  else if ((cmd == 'm' || cmd == 'd' || cmd == 't') && size == 4){
+    unsigned long value;
+    byte index = cmd == 'm' ? 0 : (cmd == 'd' ? 1 : 2);
+    unsigned long *fields[3] = {&stored_vars.muem_per_pulse, &stored_vars.debounce_time_ms, &stored_vars.bat_critical_mv};
+    memcpy(&value, payload, 4);
+    if (value > limits[index]){
+      send_frame(cmd, frame_err, NULL, 0);
+    }
+    else {
+      *fields[index] = value;
+      EEPROM.put(0, stored_vars);
+      send_frame(cmd, frame_ok, NULL, 0);
+    }
+  }
+  else if (cmd == 'a' && size == 13){
+    eepdata new_vars = stored_vars;
+    unsigned long *fields[3] = {&new_vars.muem_per_pulse, &new_vars.debounce_time_ms, &new_vars.bat_critical_mv};
+    bool valid = true;
+    for (byte i=0; i<3; i++){
+      if (payload[0] & (1 << i)){
+        unsigned long value;
+        memcpy(&value, &payload[1 + 4*i], 4);
+        if (value > limits[i]){
+          valid = false;
+        }
+        else {
+          *fields[i] = value;
+        }
+      }
+    }
+    if (valid){
+      stored_vars = new_vars;
+      EEPROM.put(0, stored_vars);
+      send_frame(cmd, frame_ok, NULL, 0);
+    }
+    else {
+      send_frame(cmd, frame_err, NULL, 0);
+    }
+  }
+  else {
+    send_frame(cmd, frame_err, NULL, 0);
+  }
+}
+
 void greet() {
   /*
   Display startup message
@@ -215,6 +483,7 @@ void on_meas() {
   Get timedelta since last pulse
   */
   unsigned long now = millis();
+  unsigned long now_us = micros();
 
   //Calculate timedelta since last pulse
   //Additional Software debouncing if required
@@ -223,6 +492,40 @@ void on_meas() {
       last_pulse_interval = now - last_pulse;
     }
     last_pulse = now;
+
+    if (streaming) {
+      byte next = (stream_head + 1) % stream_buf_size;
+      //Drop pulse if ring buffer is full, the host detects this by the gap in sequence numbers
+      if (next != stream_tail) {
+        stream_buf_ts[stream_head] = now_us;
+        stream_buf_seq[stream_head] = stream_seq;
+        stream_head = next;
+      }
+      stream_seq++;
+    }
+  }
+}
+
+void stream_flush() {
+  /*
+  Send all pulses in the streaming ring buffer as binary records
+  */
+  byte record[6];
+
+  while (stream_tail != stream_head) {
+    noInterrupts();
+    unsigned long ts = stream_buf_ts[stream_tail];
+    byte seq = stream_buf_seq[stream_tail];
+    stream_tail = (stream_tail + 1) % stream_buf_size;
+    interrupts();
+
+    record[0] = stream_header;
+    record[1] = seq;
+    record[2] = ts & 0xFF;
+    record[3] = (ts >> 8) & 0xFF;
+    record[4] = (ts >> 16) & 0xFF;
+    record[5] = (ts >> 24) & 0xFF;
+    Serial.write(record, 6);
   }
 }
 